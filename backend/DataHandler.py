@@ -1,52 +1,159 @@
 import os
+import json
 import torch
 import numpy as np
 from PIL import Image
 from torch.utils.data import Dataset
+from concurrent.futures import ThreadPoolExecutor
 import SimpleITK as sitk
 
+from preprocessing import normalize_to_uint8
+
+# ============================================================================
+# DECODING
+# ============================================================================
+def load_normalized_image(img_path, size=None):
+    """
+    Read an .mha, keep the first slice if 3D and min-max scale it to uint8.
+    With `size`, resize to size x size (LANCZOS, as training transforms do).
+    """
+    image = sitk.ReadImage(img_path)
+    img_array = sitk.GetArrayFromImage(image)
+
+    # Handle different array shapes
+    if len(img_array.shape) == 3:
+        img_array = img_array[0]  # Take first slice if 3D
+
+    # Normalize to 0-255 range
+    img_array = normalize_to_uint8(img_array, zero_if_flat=True)
+
+    if size is not None and img_array.shape != (size, size):
+        img_array = np.asarray(Image.fromarray(img_array).resize((size, size), Image.Resampling.LANCZOS))
+    return img_array
+
+# ============================================================================
+# PACKED CACHE (decode every image once, memory-map it afterwards)
+# ============================================================================
+def pack_images(img_names, images_dir, cache_prefix, size=512, workers=None):
+    """
+    Decode and normalize every image once into `<cache_prefix>.npy`, a
+    (N, size, size) uint8 array, plus `<cache_prefix>.json` mapping image
+    names to rows. NoduleDataset(cache_prefix=...) then memory-maps it, so
+    epochs and DataLoader workers share the OS page cache instead of
+    decoding each .mha again.
+    """
+    img_names = list(dict.fromkeys(img_names))
+    os.makedirs(os.path.dirname(os.path.abspath(cache_prefix)), exist_ok=True)
+    array_path, index_path = f"{cache_prefix}.npy", f"{cache_prefix}.json"
+    tmp_path, tmp_index_path = f"{cache_prefix}.tmp.npy", f"{cache_prefix}.tmp.json"
+
+    images = None
+    try:
+        images = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8,
+                                           shape=(len(img_names), size, size))
+
+        def pack_one(row):
+            images[row] = load_normalized_image(os.path.join(images_dir, img_names[row]), size)
+
+        # SimpleITK, numpy and PIL release the GIL, so threads decode in parallel
+        with ThreadPoolExecutor(max_workers=workers or min(8, os.cpu_count() or 1)) as pool:
+            for done, _ in enumerate(pool.map(pack_one, range(len(img_names))), 1):
+                if done % 500 == 0 or done == len(img_names):
+                    print(f"📦 Packed {done}/{len(img_names)} images")
+        images.flush()
+        images = None  # close the memory map before the file is renamed
+        with open(tmp_index_path, "w") as f:
+            json.dump({"size": size, "images_dir": os.path.abspath(images_dir), "names": img_names}, f)
+
+        # Swap both files in together; if we stop in between, load_packed_index
+        # sees an array and index that disagree and refuses the cache
+        os.replace(tmp_path, array_path)
+        os.replace(tmp_index_path, index_path)
+    except BaseException:
+        images = None
+        for path in (tmp_path, tmp_index_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return array_path, index_path
+
+def load_packed_index(cache_prefix):
+    """
+    (image name -> row, image size) from a cache written by pack_images.
+    Raises ValueError if the index does not describe the array next to it.
+    """
+    with open(f"{cache_prefix}.json") as f:
+        index = json.load(f)
+    shape = np.load(f"{cache_prefix}.npy", mmap_mode="r").shape  # reads the header only
+    if shape != (len(index["names"]), index["size"], index["size"]):
+        raise ValueError(f"The cache {cache_prefix} is incomplete (array {shape}, index for "
+                         f"{len(index['names'])} x {index['size']}px). Re-run pack_dataset.py.")
+    return {name: row for row, name in enumerate(index["names"])}, index["size"]
+
 # ============================================================================
 # CUSTOM DATASET CLASS
 # ============================================================================
 class NoduleDataset(Dataset):
-    def __init__(self, dataframe, images_dir, transform=None):
+    """
+    Chest X-rays with nodule labels from `dataframe` (img_name, label).
+    By default each sample is decoded from its .mha and `transform` gets a
+    3-channel PIL image. With `cache_prefix` samples are read from a
+    pack_images cache and `transform` gets a (3, H, W) uint8 tensor instead,
+    so use tensor transforms there (e.g. Resize and ConvertImageDtype rather
+    than ToTensor).
+    """
+
+    def __init__(self, dataframe, images_dir, transform=None, cache_prefix=None):
         self.df = dataframe.reset_index(drop=True)
         self.images_dir = images_dir
         self.transform = transform
-        
+        self.cache_prefix = cache_prefix
+        self._packed = None  # memory map, opened lazily in each DataLoader worker
+        self.rows = None
+        if cache_prefix is not None:
+            rows, _ = load_packed_index(cache_prefix)
+            missing = [name for name in self.df['img_name'] if name not in rows]
+            if missing:
+                raise KeyError(f"{len(missing)} image(s) are not in the cache {cache_prefix}, "
+                               f"e.g. {missing[0]}. Re-run pack_dataset.py.")
+            self.rows = [rows[name] for name in self.df['img_name']]
+
     def __len__(self):
         return len(self.df)
-    
+
+    def __getstate__(self):
+        # Workers started with spawn re-open the file instead of receiving a pickled copy
+        state = self.__dict__.copy()
+        state["_packed"] = None
+        return state
+
+    def _load_packed(self, idx):
+        """(3, H, W) uint8 tensor straight from the page cache, no decode or PIL round-trip."""
+        if self._packed is None:
+            self._packed = np.load(f"{self.cache_prefix}.npy", mmap_mode="r")
+        img = torch.from_numpy(self._packed[self.rows[idx]].copy())  # copy: the map is read-only
+        return img.unsqueeze(0).expand(3, -1, -1)  # 3 channels as a view, not 3 copies
+
     def __getitem__(self, idx):
         row = self.df.iloc[idx]
+        label = torch.tensor(row['label'], dtype=torch.long)
+
+        if self.rows is not None:
+            image = self._load_packed(idx)
+            if self.transform:
+                image = self.transform(image)
+            return image, label
+
         img_path = os.path.join(self.images_dir, row['img_name'])
-        
-        # Load .mha image
-        image = sitk.ReadImage(img_path)
-        img_array = sitk.GetArrayFromImage(image)
-        
-        # Handle different array shapes
-        if len(img_array.shape) == 3:
-            img_array = img_array[0]  # Take first slice if 3D
-        
-        # Normalize to 0-255 range
-        img_array = img_array.astype(np.float32)
-        img_min, img_max = img_array.min(), img_array.max()
-        if img_max > img_min:
-            img_array = ((img_array - img_min) / (img_max - img_min) * 255).astype(np.uint8)
-        else:
-            img_array = np.zeros_like(img_array, dtype=np.uint8)
-        
+        img_array = load_normalized_image(img_path)
+
         # Convert to 3-channel (RGB) for ViT
         img_array = np.stack([img_array, img_array, img_array], axis=-1)
-        
+
         # Convert to PIL Image for transforms
-        from PIL import Image
         image = Image.fromarray(img_array)
-        
+
         if self.transform:
             image = self.transform(image)
-        
-        label = torch.tensor(row['label'], dtype=torch.long)
-        
-        return image, label
\ No newline at end of file
+
+        return image, label
@@ -0,0 +1,155 @@
+import os
+import math
+import time
+import asyncio
+
+from starlette.responses import JSONResponse
+
+from metrics import REGISTRY
+from executor import CPU_POOL_SIZE
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# Requests per endpoint that may run at once, and how many more may wait for
+# a slot. Everything past that is refused with 503 before its body is read, so
+# a burst cannot fill memory with uploads, float32 images and PNG buffers.
+ADMISSION_CONCURRENCY = int(os.getenv("ADMISSION_CONCURRENCY", str(CPU_POOL_SIZE * 2)))
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", str(ADMISSION_CONCURRENCY * 4)))
+# Per-endpoint overrides: "predict=8:32,predict_batch=1:2" (concurrency:queue)
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "predict_batch=2:4,jobs=4:16")
+# Longest a request waits for a slot before it is refused
+ADMISSION_TIMEOUT_S = float(os.getenv("ADMISSION_TIMEOUT_S", "30"))
+
+ADMISSION_INFLIGHT = REGISTRY.gauge(
+    "nodule_admission_inflight", "Requests holding an admission slot.", ["endpoint"])
+ADMISSION_QUEUED = REGISTRY.gauge(
+    "nodule_admission_queued", "Requests waiting for an admission slot.", ["endpoint"])
+ADMISSION_REJECTED = REGISTRY.counter(
+    "nodule_admission_rejected_total", "Requests refused with 503.", ["endpoint", "reason"])
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "nodule_admission_wait_seconds", "Time admitted requests waited for a slot.", ["endpoint"])
+
+
+def parse_limits(text=ADMISSION_LIMITS):
+    """'name=concurrency:queue,...' -> {name: (concurrency, queue)}."""
+    limits = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        concurrency, _, queue = value.partition(":")
+        concurrency = int(concurrency)
+        limits[name.strip()] = (concurrency, int(queue) if queue else concurrency * 4)
+    return limits
+
+
+# ============================================================
+# GATE
+# ============================================================
+class Overloaded(Exception):
+    """Raised when a request is refused; `retry_after` is a hint in whole seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """
+    A concurrency limit with a bounded, deadline-limited wait queue for one
+    endpoint. Use `await gate.acquire()` / `gate.release()` around the work.
+    """
+
+    def __init__(self, name, concurrency=ADMISSION_CONCURRENCY, max_queue=ADMISSION_QUEUE,
+                 timeout_s=ADMISSION_TIMEOUT_S):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.timeout_s = timeout_s
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._avg_hold_s = 1.0  # running average of how long a slot is held, for Retry-After
+
+    def retry_after(self):
+        """Rough time for the current queue to drain, clamped to 1-60 s."""
+        backlog = (self.waiting + 1) / self.concurrency
+        return min(60, max(1, math.ceil(backlog * self._avg_hold_s)))
+
+    async def acquire(self):
+        """Wait for a slot and return the time it was granted. Raises Overloaded."""
+        start = time.perf_counter()
+        if self._slots.locked():
+            if self.waiting >= self.max_queue:
+                ADMISSION_REJECTED.inc(endpoint=self.name, reason="queue_full")
+                raise Overloaded("queue_full", self.retry_after())
+            self.waiting += 1
+            ADMISSION_QUEUED.inc(endpoint=self.name)
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.timeout_s)
+            except asyncio.TimeoutError:
+                ADMISSION_REJECTED.inc(endpoint=self.name, reason="timeout")
+                raise Overloaded("timeout", self.retry_after())
+            finally:
+                self.waiting -= 1
+                ADMISSION_QUEUED.dec(endpoint=self.name)
+        else:
+            await self._slots.acquire()
+        granted = time.perf_counter()
+        ADMISSION_WAIT_SECONDS.observe(granted - start, endpoint=self.name)
+        ADMISSION_INFLIGHT.inc(endpoint=self.name)
+        return granted
+
+    def release(self, granted):
+        self._avg_hold_s += 0.2 * ((time.perf_counter() - granted) - self._avg_hold_s)
+        ADMISSION_INFLIGHT.dec(endpoint=self.name)
+        self._slots.release()
+
+
+def build_gates(endpoints, limits=None):
+    """One AdmissionGate per endpoint name, with ADMISSION_LIMITS overrides applied."""
+    limits = parse_limits() if limits is None else limits
+    gates = {}
+    for name in endpoints:
+        concurrency, max_queue = limits.get(name, (ADMISSION_CONCURRENCY, ADMISSION_QUEUE))
+        gates[name] = AdmissionGate(name, concurrency, max_queue)
+    return gates
+
+
+# ============================================================
+# ASGI MIDDLEWARE
+# ============================================================
+class AdmissionMiddleware:
+    """
+    Gate POSTs to the paths in `paths` (path -> gate name). Runs before the
+    body is read, so refused requests never spool their upload. The slot is
+    held until the whole response has been sent (or the request failed or
+    was abandoned), since streaming endpoints do their work while sending.
+    """
+
+    def __init__(self, app, paths, gates):
+        self.app = app
+        self.paths = paths
+        self.gates = gates
+
+    async def __call__(self, scope, receive, send):
+        name = None
+        if scope["type"] == "http" and scope["method"] == "POST":
+            name = self.paths.get(scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        gate = self.gates[name]
+        try:
+            granted = await gate.acquire()
+        except Overloaded as e:
+            response = JSONResponse({"error": "Server is busy. Please try again shortly.", "reason": e.reason},
+                                    status_code=503, headers={"Retry-After": str(e.retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release(granted)
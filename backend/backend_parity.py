@@ -0,0 +1,107 @@
+"""
+Parity check of the optimized inference backends against the eager model.
+
+Runs every bundled test case through eager PyTorch and each requested
+backend, then compares class probabilities, predicted labels and the
+normalized layer4 attention maps. Exits non-zero if a backend drifts past
+its tolerance (looser for int8 than for fp32 backends).
+
+Example:
+    python backend_parity.py --backends torchscript onnx int8_dynamic int8_static
+"""
+import sys
+import json
+import time
+import argparse
+
+import torch
+
+from benchmark import find_cases
+from inference_backends import INFERENCE_BACKENDS
+
+
+# ============================================================
+# COMPARISON
+# ============================================================
+def scale_attention(attention):
+    """Per-sample min-max scaling, as infer_batch applies before rendering."""
+    attention = attention - attention.amin(dim=(1, 2, 3), keepdim=True)
+    return attention / (attention.amax(dim=(1, 2, 3), keepdim=True) + 1e-8)
+
+
+def compare_backend(backend, inputs, reference):
+    """Max/mean differences of one backend's outputs against eager."""
+    prob_diffs, attention_diffs, agree, elapsed = [], [], 0, 0.0
+    for tensor, (ref_probs, ref_attention) in zip(inputs, reference):
+        start = time.perf_counter()
+        logits, attention = backend(tensor)
+        elapsed += time.perf_counter() - start
+
+        probs = torch.softmax(logits.float().cpu(), dim=1)
+        prob_diffs.append((probs - ref_probs).abs().max().item())
+        attention_diffs.append((scale_attention(attention.float().cpu()) - ref_attention).abs().mean().item())
+        agree += int(probs.argmax(1).item() == ref_probs.argmax(1).item())
+
+    return {
+        "max_prob_diff": round(max(prob_diffs), 6),
+        "mean_prob_diff": round(sum(prob_diffs) / len(prob_diffs), 6),
+        "max_attention_mad": round(max(attention_diffs), 6),
+        "label_agreement": f"{agree}/{len(inputs)}",
+        "mean_forward_ms": round(elapsed * 1000.0 / len(inputs), 3),
+    }
+
+
+# ============================================================
+# MAIN
+# ============================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare inference backends against eager PyTorch.")
+    parser.add_argument("--backends", nargs="+", default=[b for b in INFERENCE_BACKENDS if b != "eager"],
+                        choices=INFERENCE_BACKENDS)
+    parser.add_argument("--dirs", nargs="+", default=["testcases"], help="Case folders next to this script")
+    parser.add_argument("--fp32-tolerance", type=float, default=1e-3,
+                        help="Max probability / mean attention difference for fp32 backends")
+    parser.add_argument("--int8-tolerance", type=float, default=0.05,
+                        help="Max probability / mean attention difference for int8 backends")
+    args = parser.parse_args(argv)
+
+    import predict_nodule_spatial as predictor
+
+    cases = find_cases(args.dirs)
+    if not cases:
+        print("No .mha cases found")
+        return 1
+
+    print(f"🧪 Preparing {len(cases)} case(s)...", file=sys.stderr)
+    inputs = [predictor.prepare_tensor_for_model(predictor.preprocess_node21_style(p)) for p in cases]
+
+    eager = predictor.build_backend("eager")
+    reference = []
+    for tensor in inputs:
+        logits, attention = eager(tensor)
+        reference.append((torch.softmax(logits.float().cpu(), dim=1), scale_attention(attention.float().cpu())))
+
+    report, failed = {}, []
+    for name in args.backends:
+        try:
+            backend = predictor.build_backend(name)
+        except Exception as e:
+            report[name] = {"error": str(e)}
+            failed.append(name)
+            print(f"❌ {name}: {e}", file=sys.stderr)
+            continue
+
+        stats = compare_backend(backend, inputs, reference)
+        tolerance = args.int8_tolerance if name.startswith("int8") else args.fp32_tolerance
+        stats["passed"] = stats["max_prob_diff"] <= tolerance and stats["max_attention_mad"] <= tolerance
+        report[name] = stats
+        if not stats["passed"]:
+            failed.append(name)
+        print(f"{'✅' if stats['passed'] else '❌'} {name}: {stats}", file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# Upper bound on images per forward pass, and how long the first request
+# in a batch may wait for others to join before the batch is run anyway.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+
+
+# ============================================================
+# MICRO-BATCHING SCHEDULER
+# ============================================================
+class MicroBatcher:
+    """
+    Gathers concurrent inference requests into one batched forward pass.
+
+    `infer_fn` takes a batch tensor of shape (N, 3, H, W) and returns a
+    tuple `(logits, attention)` whose first dimension is N. Callers submit
+    tensors with one or more rows and get back only their own rows.
+    """
+
+    def __init__(self, infer_fn, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._carry = None
+
+    def submit(self, img_tensor):
+        """Queue a (N, 3, H, W) tensor and return a Future of (logits, attention)."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((img_tensor, future))
+        return future
+
+    def infer(self, img_tensor):
+        """Blocking helper: submit and wait for this request's slice of the batch."""
+        return self.submit(img_tensor).result()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        """Block for the first request, then keep gathering until full or timed out."""
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = self._queue.get()
+        batch = [first]
+        rows = first[0].shape[0]
+        deadline = time.monotonic() + self.max_wait
+
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if rows + item[0].shape[0] > self.max_batch_size:
+                # Doesn't fit: it starts the next batch instead
+                self._carry = item
+                break
+            batch.append(item)
+            rows += item[0].shape[0]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._process(batch)
+
+    def _process(self, batch):
+        # Requests cancelled while waiting don't need a forward pass
+        batch = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        try:
+            batch_tensor = torch.cat([t for t, _ in batch], dim=0)
+            logits, attention = self.infer_fn(batch_tensor)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        # Split the batched outputs back out per request
+        start = 0
+        for tensor, future in batch:
+            end = start + tensor.shape[0]
+            future.set_result((logits[start:end], attention[start:end]))
+            start = end
@@ -0,0 +1,234 @@
+"""
+Batch scoring CLI built on the predict_nodule_spatial pipeline.
+
+Decodes and standardizes images in parallel worker processes, runs the
+model on batches, and streams one JSONL/CSV row per file as results come
+in. Files already scored in the output are skipped, so an interrupted
+run can simply be restarted; files whose row is an error are retried
+(the new row is appended after the old one).
+
+Example:
+    python batch_score.py testcases simulations --output scores.jsonl --workers 4 --batch-size 16
+"""
+import os
+import sys
+import csv
+import json
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import torch
+
+from ingest import SUPPORTED_EXTENSIONS
+
+OUTPUT_FIELDS = ["file", "prediction", "confidence", "prob_nodule", "heatmap", "error"]
+
+
+# ============================================================
+# INPUT DISCOVERY / RESUME
+# ============================================================
+def find_images(inputs, extensions=SUPPORTED_EXTENSIONS):
+    """Yield absolute paths of supported images under the given files/directories."""
+    for item in inputs:
+        if os.path.isfile(item):
+            yield os.path.abspath(item)
+            continue
+        for root, dirs, files in os.walk(item):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(extensions):
+                    yield os.path.abspath(os.path.join(root, name))
+
+
+def load_scored_files(output_path, output_format):
+    """Return the set of files that already have a successful row in the output."""
+    if output_path == "-" or not os.path.exists(output_path):
+        return set()
+
+    scored = set()
+    with open(output_path, newline="") as f:
+        if output_format == "csv":
+            for row in csv.DictReader(f):
+                if not row.get("error"):
+                    scored.add(row["file"])
+        else:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    if "error" not in row:
+                        scored.add(row["file"])
+                except (ValueError, KeyError):
+                    continue  # half-written last line from an interrupted run
+    return scored
+
+
+# ============================================================
+# OUTPUT
+# ============================================================
+class ResultWriter:
+    """Append rows as JSONL or CSV, flushing each one so progress is never lost."""
+
+    def __init__(self, output_path, output_format):
+        self.output_format = output_format
+        if output_path == "-":
+            self.f = sys.stdout
+            needs_header = True
+        else:
+            needs_header = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+            self.f = open(output_path, "a", newline="")
+
+        self.csv_writer = None
+        if output_format == "csv":
+            self.csv_writer = csv.DictWriter(self.f, fieldnames=OUTPUT_FIELDS)
+            if needs_header:
+                self.csv_writer.writeheader()
+
+    def write(self, row):
+        if self.csv_writer is not None:
+            self.csv_writer.writerow({k: row.get(k) for k in OUTPUT_FIELDS})
+        else:
+            self.f.write(json.dumps(row) + "\n")
+        self.f.flush()
+
+    def close(self):
+        if self.f is not sys.stdout:
+            self.f.close()
+
+
+# ============================================================
+# WORKERS
+# ============================================================
+def standardize_file(path):
+    """Worker: decode + NODE21-standardize one file. Returns (path, uint8 image, error)."""
+    import predict_nodule_spatial as predictor
+    from preprocessing import normalize_to_uint8
+
+    try:
+        std_img = predictor.preprocess_node21_style(path)
+        return path, normalize_to_uint8(std_img), None
+    except Exception as e:
+        return path, None, f"Preprocessing failed: {str(e)}"
+
+
+def heatmap_name(path):
+    """
+    File name for a heatmap: the image's stem plus a short hash of its full
+    path, since different input folders often hold files with the same name.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{hashlib.sha1(path.encode('utf-8')).hexdigest()[:8]}.png"
+
+
+def score_batch(items, heatmap_dir=None):
+    """Run one batched forward pass over [(path, uint8 image)] and build output rows."""
+    import predict_nodule_spatial as predictor
+    from preprocessing import to_model_batch
+
+    logits, attention = predictor.infer_batch(to_model_batch([img for _, img in items]))
+    probs = torch.softmax(logits, dim=1)
+
+    rows = []
+    for i, (path, img_u8) in enumerate(items):
+        pred_class = int(torch.argmax(probs[i]).item())
+        row = {
+            "file": path,
+            "prediction": predictor.CLASS_NAMES[pred_class],
+            "confidence": round(probs[i][pred_class].item(), 4),
+            "prob_nodule": round(probs[i][1].item(), 4),
+        }
+        if heatmap_dir:
+            attention_map = predictor.normalize_attention_map(attention[i].numpy())
+            heatmap_path = os.path.join(heatmap_dir, heatmap_name(path))
+            with open(heatmap_path, "wb") as f:
+                f.write(predictor.heatmap_overlay_png(img_u8, attention_map))
+            row["heatmap"] = heatmap_path
+        rows.append(row)
+    return rows
+
+
+# ============================================================
+# MAIN LOOP
+# ============================================================
+def run(inputs, output_path, output_format="jsonl", workers=2, batch_size=16, heatmap_dir=None):
+    scored = load_scored_files(output_path, output_format)
+    todo = [p for p in find_images(inputs) if p not in scored]
+    print(f"🗂️ {len(todo)} file(s) to score ({len(scored)} already in output)", file=sys.stderr)
+    if not todo:
+        return 0
+
+    if heatmap_dir:
+        os.makedirs(heatmap_dir, exist_ok=True)
+
+    writer = ResultWriter(output_path, output_format)
+    done = 0
+    batch = []
+
+    def flush_batch():
+        nonlocal done, batch
+        if not batch:
+            return
+        try:
+            rows = score_batch(batch, heatmap_dir)
+        except Exception as e:
+            rows = [{"file": path, "error": f"Model inference failed: {str(e)}"} for path, _ in batch]
+        for row in rows:
+            writer.write(row)
+        done += len(batch)
+        batch = []
+        print(f"✅ {done}/{len(todo)}", file=sys.stderr)
+
+    # spawn: forking after torch has started its thread pools can deadlock
+    ctx = multiprocessing.get_context("spawn")
+    max_in_flight = max(workers, 1) * 2 + batch_size
+    paths = iter(todo)
+    pending = set()
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            while True:
+                # Keep the pool busy without holding the whole archive in memory
+                for path in paths:
+                    pending.add(pool.submit(standardize_file, path))
+                    if len(pending) >= max_in_flight:
+                        break
+
+                if not pending:
+                    break
+
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, img_u8, error = future.result()
+                    if error:
+                        writer.write({"file": path, "error": error})
+                        done += 1
+                        continue
+                    batch.append((path, img_u8))
+                    if len(batch) >= batch_size:
+                        flush_batch()
+
+            flush_batch()
+    finally:
+        writer.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score chest X-rays in bulk with the WSOD model.")
+    parser.add_argument("inputs", nargs="+", help="Image files or directories (searched recursively)")
+    parser.add_argument("--output", "-o", default="-", help="Output file, or '-' for stdout (default)")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default=None,
+                        help="Output format (default: from the output file extension, else jsonl)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Parallel decode/standardize processes")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per forward pass")
+    parser.add_argument("--heatmap-dir", default=None, help="Also save heatmap overlays as PNGs here")
+    args = parser.parse_args(argv)
+
+    output_format = args.format or ("csv" if args.output.lower().endswith(".csv") else "jsonl")
+    return run(args.inputs, args.output, output_format, args.workers, args.batch_size, args.heatmap_dir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
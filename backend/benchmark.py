@@ -0,0 +1,250 @@
+"""
+Reproducible performance benchmark over the bundled .mha cases.
+
+Reports per-stage latency percentiles for the predict_nodule_spatial
+pipeline, end-to-end HTTP throughput against the FastAPI app at several
+concurrency levels, and peak RSS. Results are written as JSON so runs can
+be compared to catch regressions.
+
+Example:
+    python benchmark.py --repeat 3 --concurrency 1 4 8 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import platform
+import argparse
+import resource
+
+import numpy as np
+
+BENCH_DIRS = ["testcases", "simulations"]
+
+
+# ============================================================
+# HELPERS
+# ============================================================
+def find_cases(dirs=BENCH_DIRS):
+    here = os.path.dirname(os.path.abspath(__file__))
+    cases = []
+    for d in dirs:
+        for root, subdirs, files in os.walk(os.path.join(here, d)):
+            subdirs.sort()
+            cases.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(".mha"))
+    return cases
+
+
+def summarize(samples_s):
+    """Latency percentiles in milliseconds."""
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000.0
+    if ms.size == 0:
+        return {"count": 0}
+    return {
+        "count": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - start
+
+
+# ============================================================
+# STAGE BENCHMARK
+# ============================================================
+def bench_stages(cases, repeat):
+    """Time each stage of predict_image separately, bypassing all caches."""
+    import torch
+    import predict_nodule_spatial as predictor
+
+    net = predictor.load_classifier()
+    stages = {name: [] for name in
+              ["preprocess_node21_style", "prepare_tensor_for_model", "forward", "attention", "encode_png_base64"]}
+
+    for _ in range(repeat):
+        for path in cases:
+            std_img, t = timed(predictor.preprocess_node21_style, path)
+            stages["preprocess_node21_style"].append(t)
+
+            img_tensor, t = timed(predictor.prepare_tensor_for_model, std_img)
+            stages["prepare_tensor_for_model"].append(t)
+
+            with torch.no_grad():
+                batch = img_tensor.to(predictor.DEVICE)
+                # Forward and attention come from one pass in serving; time both halves
+                start = time.perf_counter()
+                features = net.base_model.forward_features(batch)
+                net.base_model.forward_head(features)
+                stages["forward"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                attention = torch.relu(features.mean(dim=1))
+                attention_map = predictor.normalize_attention_map(attention[0].cpu().numpy())
+                stages["attention"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            predictor.numpy_to_base64(std_img)
+            predictor.generate_heatmap_overlay_from_data(std_img, attention_map)
+            stages["encode_png_base64"].append(time.perf_counter() - start)
+
+    return {name: summarize(samples) for name, samples in stages.items()}
+
+
+# ============================================================
+# HTTP BENCHMARK
+# ============================================================
+async def _http_level(client, payloads, concurrency, total):
+    latencies = []
+    errors = 0
+    queue = list(range(total))
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            i = queue.pop()
+            name, data = payloads[i % len(payloads)]
+            start = time.perf_counter()
+            response = await client.post("/predict", files={"file": (name, data)})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200 or "error" in response.json():
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 3),
+        "latency": summarize(latencies),
+    }
+
+
+async def bench_http(cases, concurrency_levels, requests_per_level, cache):
+    """Drive /predict in-process through httpx's ASGI transport."""
+    try:
+        import httpx
+    except ImportError:
+        print("⚠️ httpx not installed; skipping HTTP benchmark (pip install httpx)", file=sys.stderr)
+        return None
+
+    import main
+    if not cache and hasattr(main.predictor_module, "result_cache"):
+        # Measure the full pipeline, not disk cache hits
+        main.predictor_module.result_cache.enabled = False
+    # The lifespan would otherwise prewarm the library and start job workers,
+    # which compete with the measured requests for the same cores
+    main.LIBRARY_PREWARM = False
+    main.JOB_WORKERS = 0
+    print(f"🌐 HTTP run: result cache {'on' if cache else 'off'}, library prewarm off, job workers off",
+          file=sys.stderr)
+
+    payloads = [(os.path.basename(p), open(p, "rb").read()) for p in cases]
+    results = []
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            # Warm-up so model/pool start-up is not counted
+            await client.post("/predict", files={"file": payloads[0]})
+            for level in concurrency_levels:
+                results.append(await _http_level(client, payloads, level, max(requests_per_level, level)))
+                print(f"🌐 concurrency={level}: {results[-1]['throughput_rps']} req/s", file=sys.stderr)
+    return results
+
+
+# ============================================================
+# REGRESSION CHECK
+# ============================================================
+def compare_reports(baseline, current, max_regression):
+    """Print p50 changes per stage; return the stages that slowed down too much."""
+    regressions = []
+    for name, stats in current.get("stages", {}).items():
+        before = baseline.get("stages", {}).get(name, {}).get("p50_ms")
+        after = stats.get("p50_ms")
+        if not before or after is None:
+            continue
+        change = (after - before) / before
+        print(f"  {name}: {before:.1f} ms -> {after:.1f} ms ({change:+.0%})", file=sys.stderr)
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+# ============================================================
+# MAIN
+# ============================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the nodule detection backend.")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the cases for stage timings")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="HTTP concurrency levels")
+    parser.add_argument("--requests", type=int, default=32, help="HTTP requests per concurrency level")
+    parser.add_argument("--cache", action="store_true", help="Leave the result cache on during the HTTP run")
+    parser.add_argument("--skip-http", action="store_true")
+    parser.add_argument("--output", "-o", default="-", help="JSON output file, or '-' for stdout")
+    parser.add_argument("--baseline", default=None, help="Earlier JSON report to compare stage p50s against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Fail if a stage p50 is this much slower than the baseline (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    cases = find_cases()
+    if not cases:
+        print("No .mha cases found under testcases/ or simulations/")
+        return 1
+
+    import torch
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "cpu_count": os.cpu_count(),
+            "platform": platform.platform(),
+        },
+        "cases": [os.path.relpath(p, os.path.dirname(os.path.abspath(__file__))) for p in cases],
+        # Background work disabled for the HTTP run so it does not skew the timings
+        "http_settings": {"result_cache": args.cache, "library_prewarm": False, "job_workers": 0},
+    }
+
+    print(f"⏱️ Timing stages over {len(cases)} case(s) x {args.repeat}...", file=sys.stderr)
+    report["stages"] = bench_stages(cases, args.repeat)
+
+    if not args.skip_http:
+        report["http"] = asyncio.run(bench_http(cases, args.concurrency, args.requests, args.cache))
+
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    text = json.dumps(report, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"📝 Wrote {args.output}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_reports(json.load(f), report, args.max_regression)
+        if regressions:
+            print(f"❌ Regressed stages: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
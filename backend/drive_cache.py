@@ -0,0 +1,284 @@
+import os
+import re
+import time
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from metrics import CACHE_EVENTS
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+DRIVE_CACHE_DIR = os.getenv("DRIVE_CACHE_DIR", os.path.join(os.getcwd(), "google_drive_cache"))
+DRIVE_CACHE_MAX_MB = float(os.getenv("DRIVE_CACHE_MAX_MB", "2048"))  # 0 = unbounded
+
+# Copy <DRIVE_LOCAL_DIR>/<file_id>.mha instead of downloading (offline runs and tests)
+DRIVE_LOCAL_DIR = os.getenv("DRIVE_LOCAL_DIR", "")
+
+# Partial downloads untouched this long are leftovers of a crash; younger
+# ones may belong to another process sharing the directory
+DRIVE_TMP_STALE_S = float(os.getenv("DRIVE_TMP_STALE_S", "3600"))
+
+# Google Drive IDs are URL-safe base64; anything else never reaches the filesystem
+FILE_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{10,128}")
+
+MET_ELEMENT_SIZES = {
+    "MET_CHAR": 1, "MET_UCHAR": 1, "MET_SHORT": 2, "MET_USHORT": 2,
+    "MET_INT": 4, "MET_UINT": 4, "MET_LONG": 8, "MET_ULONG": 8,
+    "MET_LONG_LONG": 8, "MET_ULONG_LONG": 8, "MET_FLOAT": 4, "MET_DOUBLE": 8,
+}
+MAX_HEADER_BYTES = 64 * 1024
+
+
+# ============================================================
+# INTEGRITY CHECK
+# ============================================================
+def read_mha_header(path):
+    """
+    Parse a MetaImage header. Returns (fields, header size in bytes).
+    Raises ValueError if the file does not start with a MetaImage header
+    (e.g. a Drive HTML error page saved as .mha).
+    """
+    with open(path, "rb") as f:
+        return parse_mha_header(f.read(MAX_HEADER_BYTES))
+
+
+def parse_mha_header(head):
+    """read_mha_header for bytes already in memory (the start of the file is enough)."""
+    fields = {}
+    offset = 0
+    while True:
+        end = head.find(b"\n", offset)
+        if end < 0:
+            raise ValueError("MetaImage header is incomplete")
+        line = head[offset:end].decode("ascii", errors="replace").strip()
+        offset = end + 1
+        if "=" not in line:
+            raise ValueError(f"Not a MetaImage header line: {line[:40]!r}")
+        key, value = (part.strip() for part in line.split("=", 1))
+        fields[key] = value
+        if key == "ElementDataFile":  # always the last header field
+            return fields, offset
+
+
+def verify_mha(path):
+    """Check that an .mha file is a complete single-file MetaImage; raise ValueError if not."""
+    fields, header_size = read_mha_header(path)
+    for key in ("NDims", "DimSize", "ElementType"):
+        if key not in fields:
+            raise ValueError(f"MetaImage header has no {key}")
+    if fields["ElementDataFile"] != "LOCAL":
+        raise ValueError("MetaImage pixel data is not stored in the same file")
+
+    data_size = os.path.getsize(path) - header_size
+    if fields.get("CompressedData", "False") == "True":
+        expected = int(fields["CompressedDataSize"]) if "CompressedDataSize" in fields else None
+    else:
+        element_size = MET_ELEMENT_SIZES.get(fields["ElementType"])
+        if element_size is None:
+            raise ValueError(f"Unknown ElementType {fields['ElementType']}")
+        expected = element_size * int(fields.get("ElementNumberOfChannels", "1"))
+        for dim in fields["DimSize"].split():
+            expected *= int(dim)
+
+    if expected is not None and data_size < expected:
+        raise ValueError(f"Pixel data truncated ({data_size} of {expected} bytes)")
+
+
+# ============================================================
+# FETCHERS
+# ============================================================
+def download_from_drive(file_id, dest_path):
+    """Download a Google Drive file to dest_path."""
+    import gdown
+
+    # gdown handles the messy Google Drive URL logic for us
+    url = f'https://drive.google.com/uc?id={file_id}'
+    if gdown.download(url, dest_path, quiet=False) is None:
+        raise IOError("gdown returned no file")
+
+
+def copy_from_local_dir(local_dir):
+    """Fetcher that copies <local_dir>/<file_id>.mha, standing in for Google Drive."""
+    def fetch(file_id, dest_path):
+        shutil.copyfile(os.path.join(local_dir, f"{file_id}.mha"), dest_path)
+    return fetch
+
+
+# ============================================================
+# CACHE
+# ============================================================
+class DriveCache:
+    """
+    Local copies of library cases, fetched once per Google Drive ID.
+
+    - Concurrent requests for the same ID share one in-flight download.
+    - Downloads land in a temp file and are verified before an atomic
+      rename, so a crash or bad response never leaves a truncated .mha.
+    - Files are evicted least recently used first once the directory grows
+      past `max_mb` (recency from mtimes, so it survives restarts).
+    - get() and fetch() pin the file they return so eviction cannot delete
+      it while it is being read; call release(file_id) when done with it.
+    - Files found on disk at startup are verified on first use, so start-up
+      cost does not grow with the cache.
+    """
+
+    def __init__(self, directory=DRIVE_CACHE_DIR, max_mb=DRIVE_CACHE_MAX_MB, fetcher=None):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        if fetcher is None:
+            fetcher = copy_from_local_dir(DRIVE_LOCAL_DIR) if DRIVE_LOCAL_DIR else download_from_drive
+        self.fetcher = fetcher
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # file_id -> size in bytes, oldest first
+        self._total = 0
+        self._inflight = {}  # file_id -> Future[path or None]
+        self._pins = {}  # file_id -> number of callers still reading the file
+        self._verified = set()  # IDs checked with verify_mha since this process started
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, file_id):
+        return os.path.join(self.directory, f"{file_id}.mha")
+
+    def _load_index(self):
+        """Rebuild the LRU order from disk, dropping stale leftovers of interrupted downloads."""
+        entries = []
+        stale_before = time.time() - DRIVE_TMP_STALE_S
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+                if name.endswith(".tmp") and st.st_mtime < stale_before:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue  # removed by another process meanwhile
+            if name.endswith(".mha"):
+                entries.append((st.st_mtime, name[:-4], st.st_size))
+
+        for _, file_id, size in sorted(entries):
+            self._index[file_id] = size
+            self._total += size
+        self._evict()
+
+    def _evict(self):
+        if self.max_bytes <= 0:
+            return
+        for file_id in list(self._index):
+            if self._total <= self.max_bytes:
+                break
+            if file_id in self._pins:
+                continue  # in use; evicted on a later pass once released
+            self._total -= self._index.pop(file_id)
+            self._verified.discard(file_id)
+            try:
+                os.remove(self._path(file_id))
+            except FileNotFoundError:
+                pass
+
+    def get(self, file_id):
+        """Path of a cached copy (pinned until release()), or None. Marks it as recently used."""
+        with self._lock:
+            return self._touch(file_id)
+
+    def release(self, file_id):
+        """Unpin a path returned by get() or fetch(); it may be evicted again once nobody holds it."""
+        with self._lock:
+            if self._pins.get(file_id, 0) > 1:
+                self._pins[file_id] -= 1
+                return
+            self._pins.pop(file_id, None)
+            self._evict()  # catch up on anything skipped while the file was pinned
+
+    def _touch(self, file_id):
+        if file_id not in self._index:
+            return None
+        path = self._path(file_id)
+        try:
+            if file_id not in self._verified:
+                verify_mha(path)
+                self._verified.add(file_id)
+            os.utime(path)
+        except FileNotFoundError:
+            self._total -= self._index.pop(file_id)
+            return None
+        except (ValueError, OSError) as e:
+            print(f"🗑️ Removing invalid cached file {file_id}.mha: {e}")
+            self._total -= self._index.pop(file_id)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        self._index.move_to_end(file_id)
+        self._pins[file_id] = self._pins.get(file_id, 0) + 1
+        return path
+
+    def fetch(self, file_id):
+        """
+        Return a local path for `file_id`, downloading it if needed, pinned
+        until release(file_id). Returns None if the ID is malformed or the
+        download failed (nothing to release then).
+        """
+        if not FILE_ID_PATTERN.fullmatch(file_id or ""):
+            print(f"❌ Rejected malformed file ID: {file_id!r}")
+            return None
+
+        with self._lock:
+            path = self._touch(file_id)
+            if path is not None:
+                CACHE_EVENTS.inc(cache="drive", result="hit")
+                return path
+            future = self._inflight.get(file_id)
+            owner = future is None
+            if owner:
+                future = self._inflight[file_id] = Future()
+
+        if not owner:
+            # Someone else is already downloading this ID; wait for their result
+            CACHE_EVENTS.inc(cache="drive", result="joined")
+            if future.result() is None:
+                return None
+            with self._lock:
+                path = self._touch(file_id)
+            # Evicted between the download and this pin (tiny cache): fetch it again
+            return path if path is not None else self.fetch(file_id)
+
+        CACHE_EVENTS.inc(cache="drive", result="miss")
+        path = None
+        try:
+            path = self._download(file_id)
+        finally:
+            with self._lock:
+                del self._inflight[file_id]
+            future.set_result(path)
+        return path
+
+    def _download(self, file_id):
+        print(f"⬇️ Downloading from Google Drive (ID: {file_id})...")
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f"{file_id}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            self.fetcher(file_id, tmp_path)
+            verify_mha(tmp_path)
+            path = self._path(file_id)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"❌ Download failed: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+
+        size = os.path.getsize(path)
+        with self._lock:
+            self._index[file_id] = size
+            self._total += size
+            self._verified.add(file_id)
+            self._pins[file_id] = self._pins.get(file_id, 0) + 1  # for the caller of fetch()
+            self._evict()
+        print(f"📂 Cached {file_id} ({size / 1e6:.1f} MB)")
+        return path
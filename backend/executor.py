@@ -0,0 +1,109 @@
+import os
+import asyncio
+import importlib
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from metrics import POOL_INFLIGHT
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# I/O pool: upload copies, Google Drive downloads, PNG encoding.
+IO_POOL_SIZE = int(os.getenv("IO_POOL_SIZE", "8"))
+
+# CPU pool: opencxr standardization and torch inference.
+#   CPU_POOL_KIND=thread  -> threads in this process (default). torch, opencv
+#                            and numpy release the GIL, and concurrent requests
+#                            can share micro-batched forward passes.
+#   CPU_POOL_KIND=process -> separate worker processes, each loading its own
+#                            copy of the model (more memory, full isolation).
+CPU_POOL_KIND = os.getenv("CPU_POOL_KIND", "thread").lower()
+CPU_POOL_SIZE = int(os.getenv("CPU_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+
+_io_pool = None
+_cpu_pool = None
+_lock = threading.Lock()
+
+
+# ============================================================
+# POOL MANAGEMENT
+# ============================================================
+def _init_cpu_worker(module_names):
+    """Import the predictor modules once per worker process so models load up front."""
+    for name in module_names:
+        module = importlib.import_module(name)
+        # Modules that load lazily expose load_models()
+        if hasattr(module, "load_models"):
+            module.load_models()
+
+
+def get_io_pool():
+    global _io_pool
+    if _io_pool is None:
+        with _lock:
+            if _io_pool is None:
+                _io_pool = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="io")
+    return _io_pool
+
+
+def get_cpu_pool(preload_modules=()):
+    """
+    Create the CPU pool on first use. Pools are created lazily so nothing
+    is started before the server (or a pre-fork parent) is ready for it.
+    """
+    global _cpu_pool
+    if _cpu_pool is None:
+        with _lock:
+            if _cpu_pool is None:
+                if CPU_POOL_KIND == "process":
+                    # spawn: forking a process that already holds torch threads can deadlock
+                    _cpu_pool = ProcessPoolExecutor(
+                        max_workers=CPU_POOL_SIZE,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_cpu_worker,
+                        initargs=(tuple(preload_modules),),
+                    )
+                else:
+                    _cpu_pool = ThreadPoolExecutor(max_workers=CPU_POOL_SIZE, thread_name_prefix="cpu")
+    return _cpu_pool
+
+
+def shutdown():
+    global _io_pool, _cpu_pool
+    with _lock:
+        if _io_pool is not None:
+            _io_pool.shutdown(wait=False, cancel_futures=True)
+            _io_pool = None
+        if _cpu_pool is not None:
+            _cpu_pool.shutdown(wait=False, cancel_futures=True)
+            _cpu_pool = None
+
+
+# ============================================================
+# ASYNC HELPERS
+# ============================================================
+async def run_io(fn, *args, **kwargs):
+    """Run a blocking I/O or encoding call without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    POOL_INFLIGHT.inc(pool="io")
+    try:
+        return await loop.run_in_executor(get_io_pool(), functools.partial(fn, *args, **kwargs))
+    finally:
+        POOL_INFLIGHT.dec(pool="io")
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """
+    Run CPU-heavy preprocessing/inference off the event loop.
+    With the process pool, `fn` and its arguments must be picklable
+    (module-level functions and numpy arrays are fine).
+    """
+    loop = asyncio.get_running_loop()
+    POOL_INFLIGHT.inc(pool="cpu")
+    try:
+        return await loop.run_in_executor(get_cpu_pool(), functools.partial(fn, *args, **kwargs))
+    finally:
+        POOL_INFLIGHT.dec(pool="cpu")
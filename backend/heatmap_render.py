@@ -0,0 +1,98 @@
+import os
+import io
+
+import numpy as np
+import cv2
+from PIL import Image
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# Longest side in pixels per named size; "full" keeps the standardized 1024x1024
+RENDER_SIZES = {"thumbnail": 256, "screen": 512, "full": None}
+RENDER_FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+RENDER_QUALITY = int(os.getenv("RENDER_QUALITY", "85"))  # JPEG/WebP default quality
+# zlib level for PNG (PIL's default 6 keeps full-size PNGs byte-identical to earlier versions)
+RENDER_PNG_COMPRESS_LEVEL = int(os.getenv("RENDER_PNG_COMPRESS_LEVEL", "6"))
+
+HEATMAP_ALPHA = 0.4  # weight of the JET heatmap over the grayscale image
+
+
+def _build_blend_lut(alpha=HEATMAP_ALPHA):
+    """
+    (256, 256, 3) table: BLEND_LUT[gray, attention] is the overlay pixel.
+    Same values as applyColorMap(JET) + cvtColor + addWeighted(1 - alpha, alpha),
+    but a single lookup per pixel instead of three full-size passes.
+    """
+    jet_bgr = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(-1, 1), cv2.COLORMAP_JET)
+    jet_rgb = jet_bgr[:, 0, ::-1].astype(np.float32)
+    gray = np.arange(256, dtype=np.float32)
+    blended = (1 - alpha) * gray[:, None, None] + alpha * jet_rgb[None, :, :]
+    return np.clip(np.rint(blended), 0, 255).astype(np.uint8)
+
+
+BLEND_LUT = _build_blend_lut()
+
+
+# ============================================================
+# RENDERING
+# ============================================================
+def target_size(shape, size="full"):
+    """(width, height) for a named size, keeping the aspect ratio and never upscaling."""
+    height, width = shape[:2]
+    longest = RENDER_SIZES[size]
+    if longest is None or max(height, width) <= longest:
+        return width, height
+    scale = longest / max(height, width)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def resize_for_display(img_u8, size="full"):
+    width, height = target_size(img_u8.shape, size)
+    if (height, width) == img_u8.shape[:2]:
+        return img_u8
+    return cv2.resize(img_u8, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def blend_heatmap(img_u8, attention_map):
+    """Overlay the [0, 1] attention map on a grayscale uint8 image at that image's size."""
+    height, width = img_u8.shape[:2]
+    attention = cv2.resize(attention_map, (width, height), interpolation=cv2.INTER_LINEAR)
+    return BLEND_LUT[img_u8, (attention * 255).astype(np.uint8)]
+
+
+def encode_image(img_u8, image_format="png", quality=None):
+    """Encode a grayscale or RGB uint8 image as PNG, JPEG or WebP bytes."""
+    buf = io.BytesIO()
+    img = Image.fromarray(img_u8)
+    if image_format == "png":
+        img.save(buf, format="PNG", compress_level=RENDER_PNG_COMPRESS_LEVEL)
+    elif image_format == "jpeg":
+        img.save(buf, format="JPEG", quality=quality or RENDER_QUALITY)
+    elif image_format == "webp":
+        img.save(buf, format="WEBP", quality=quality or RENDER_QUALITY)
+    else:
+        raise ValueError(f"Unknown image format: {image_format}")
+    return buf.getvalue()
+
+
+def render_images(img_u8, attention_map, size="full", image_format="png", quality=None):
+    """
+    Preview and heatmap overlay at the requested size and format, blended
+    after downscaling so smaller sizes cost proportionally less.
+    Returns (preview bytes, heatmap bytes).
+    """
+    small = resize_for_display(img_u8, size)
+    return (encode_image(small, image_format, quality),
+            encode_image(blend_heatmap(small, attention_map), image_format, quality))
+
+
+def render_options_error(size, image_format, quality):
+    """Error message for unsupported ?size= / ?format= / ?quality=, else None."""
+    if size not in RENDER_SIZES:
+        return f"Unknown size '{size}'. Choose from {', '.join(RENDER_SIZES)}."
+    if image_format not in RENDER_FORMATS:
+        return f"Unknown format '{image_format}'. Choose from {', '.join(RENDER_FORMATS)}."
+    if quality is not None and not 1 <= quality <= 100:
+        return "quality must be between 1 and 100."
+    return None
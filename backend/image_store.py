@@ -0,0 +1,86 @@
+import os
+import io
+import base64
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from result_cache import bytes_sha256
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+IMAGE_STORE_MAX_MB = float(os.getenv("IMAGE_STORE_MAX_MB", "256"))
+# Image ids are content hashes, so a URL's bytes never change
+IMAGE_CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "public, max-age=86400, immutable")
+
+
+# Formats /images can serve; PNG is what the predictor renders
+IMAGE_FORMATS = {"png": "image/png", "webp": "image/webp"}
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "85"))
+
+
+# ============================================================
+# HELPERS
+# ============================================================
+def data_url_to_bytes(data_url):
+    """Decode a base64 data URL back to raw bytes."""
+    _, encoded = data_url.split(",", 1)
+    return base64.b64decode(encoded)
+
+
+def bytes_to_data_url(data, media_type="image/png"):
+    """Encode raw image bytes as a base64 data URL."""
+    return f"data:{media_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def reencode_image(data, image_format):
+    """Re-encode PNG bytes into another format from IMAGE_FORMATS."""
+    buf = io.BytesIO()
+    with Image.open(io.BytesIO(data)) as img:
+        if image_format == "webp":
+            img.save(buf, format="WEBP", quality=IMAGE_WEBP_QUALITY)
+        else:
+            img.save(buf, format=image_format.upper())
+    return buf.getvalue()
+
+
+# ============================================================
+# CONTENT-ADDRESSED IMAGE STORE
+# ============================================================
+class ImageStore:
+    """
+    Size-bounded in-memory LRU of rendered images, keyed by content hash.
+    The id doubles as the ETag, so browsers and CDNs can cache the
+    /images responses indefinitely.
+    """
+
+    def __init__(self, max_mb=IMAGE_STORE_MAX_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._items = OrderedDict()  # image_id -> (media_type, bytes), oldest first
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def put(self, data, media_type="image/png", image_id=None):
+        """Store image bytes and return their id (the content hash unless given)."""
+        if image_id is None:
+            image_id = bytes_sha256(data)[:32]
+        with self._lock:
+            if image_id in self._items:
+                self._items.move_to_end(image_id)
+                return image_id
+            self._items[image_id] = (media_type, data)
+            self._total += len(data)
+            while self._total > self.max_bytes and len(self._items) > 1:
+                _, (_, old) = self._items.popitem(last=False)
+                self._total -= len(old)
+        return image_id
+
+    def get(self, image_id):
+        """Return (media_type, bytes) or None."""
+        with self._lock:
+            item = self._items.get(image_id)
+            if item is not None:
+                self._items.move_to_end(image_id)
+            return item
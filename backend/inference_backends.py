@@ -0,0 +1,249 @@
+import os
+import copy
+import tempfile
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# Selected the same way as PREDICT_MODULE. Every backend returns the
+# classification logits and the layer4 attention map, like
+# WSODModel.forward_with_attention.
+#   eager        -> the PyTorch model as loaded (default)
+#   torchscript  -> traced + frozen TorchScript graph
+#   compile      -> torch.compile (needs a C++ compiler on the host)
+#   onnx         -> ONNX Runtime, fp32
+#   int8_dynamic -> ONNX Runtime, int8 weights, activations quantized on the fly
+#   int8_static  -> ONNX Runtime, int8 weights and activations calibrated on the bundled test cases
+INFERENCE_BACKENDS = ("eager", "torchscript", "compile", "onnx", "int8_dynamic", "int8_static")
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager").lower()
+INT8_CALIBRATION_SAMPLES = int(os.getenv("INT8_CALIBRATION_SAMPLES", "16"))
+
+ONNX_OPSET = 17
+# Bump when the export or quantization code changes so graphs cached in
+# MODEL_CACHE_DIR are rebuilt instead of reused
+ONNX_EXPORT_VERSION = "2"
+MODEL_INPUT_SHAPE = (1, 3, 224, 224)
+
+
+# ============================================================
+# BACKENDS
+# ============================================================
+class AttentionOutputs(nn.Module):
+    """forward() returns (logits, attention) so both outputs survive tracing and export."""
+
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x):
+        return self.net.forward_with_attention(x)
+
+
+class EagerBackend:
+    name = "eager"
+
+    def __init__(self, net, device):
+        self.net = net
+        self.device = device
+
+    def __call__(self, batch_tensor):
+        """(N, 3, 224, 224) -> logits (N, num_classes), attention (N, 1, h, w)."""
+        with torch.no_grad():
+            return self.net.forward_with_attention(batch_tensor.to(self.device))
+
+
+class TorchScriptBackend(EagerBackend):
+    name = "torchscript"
+
+    def __init__(self, net, device):
+        super().__init__(net, device)
+        example = torch.zeros(MODEL_INPUT_SHAPE, device=device)
+        with torch.no_grad():
+            traced = torch.jit.trace(AttentionOutputs(net).eval(), example)
+            # Folds batch norm into the convolutions and drops training-only code
+            self.module = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    def __call__(self, batch_tensor):
+        with torch.no_grad():
+            return self.module(batch_tensor.to(self.device))
+
+
+class CompiledBackend(EagerBackend):
+    name = "compile"
+
+    def __init__(self, net, device):
+        super().__init__(net, device)
+        # dynamic=True: micro-batches vary in size, avoid one recompile per size
+        self.module = torch.compile(AttentionOutputs(net).eval(), dynamic=True)
+        self(torch.zeros(MODEL_INPUT_SHAPE))  # compile now, not on the first request
+
+    def __call__(self, batch_tensor):
+        with torch.no_grad():
+            return self.module(batch_tensor.to(self.device))
+
+
+class OnnxRuntimeBackend:
+    """Runs an exported graph on the CPU with ONNX Runtime (fp32 or quantized)."""
+
+    def __init__(self, onnx_path, name="onnx"):
+        import onnxruntime as ort
+
+        self.name = name
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # Follow torch's thread setting so per-worker limits apply to both runtimes
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, batch_tensor):
+        batch = np.ascontiguousarray(batch_tensor.detach().cpu().numpy(), dtype=np.float32)
+        logits, attention = self.session.run(["logits", "attention"], {"input": batch})
+        return torch.from_numpy(logits), torch.from_numpy(attention)
+
+
+# ============================================================
+# EXPORT / QUANTIZATION (cached next to the serialized model)
+# ============================================================
+def _atomic_write(path, write_fn):
+    """Call write_fn(tmp_path) and move the result into place, so readers never see half a file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def export_onnx(net, path):
+    """Export (logits, attention) with a dynamic batch axis."""
+    if any(p.device.type != "cpu" for p in net.parameters()):
+        net = copy.deepcopy(net).cpu()
+    wrapper = AttentionOutputs(net).eval()
+    example = torch.zeros(MODEL_INPUT_SHAPE)
+
+    kwargs = dict(
+        input_names=["input"], output_names=["logits", "attention"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}, "attention": {0: "batch"}},
+        opset_version=ONNX_OPSET,
+    )
+
+    def write(tmp_path):
+        with torch.no_grad():
+            try:
+                # One self-contained file (ResNet50 is far below the 2 GB protobuf limit)
+                torch.onnx.export(wrapper, (example,), tmp_path, external_data=False, **kwargs)
+            except TypeError:
+                torch.onnx.export(wrapper, (example,), tmp_path, **kwargs)  # older torch
+
+    print(f"📦 Exporting ONNX graph to {path}...")
+    _atomic_write(path, write)
+
+
+def prepare_for_quantization(fp32_path, path):
+    """
+    Run ONNX Runtime's shape inference and graph cleanup before quantizing.
+    Without it the quantizer can trip over the exporter's shape annotations.
+    """
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    if not os.path.exists(path):
+        try:
+            _atomic_write(path, lambda tmp_path: quant_pre_process(fp32_path, tmp_path))
+        except Exception as e:
+            print(f"⚠️ Quantization pre-processing failed, quantizing the raw export: {e}")
+            return fp32_path
+    return path
+
+
+def quantize_onnx_dynamic(fp32_path, path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    print(f"📦 Quantizing (dynamic int8) to {path}...")
+    _atomic_write(path, lambda tmp_path: quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8))
+
+
+def quantize_onnx_static(fp32_path, path, calibration_data):
+    """Calibrate activation ranges on real inputs, then write a QDQ int8 graph."""
+    from onnxruntime.quantization import (
+        quantize_static, CalibrationDataReader, QuantFormat, QuantType,
+    )
+
+    class TensorReader(CalibrationDataReader):
+        def __init__(self, tensors):
+            self.tensors = iter(tensors)
+
+        def get_next(self):
+            tensor = next(self.tensors, None)
+            return None if tensor is None else {"input": tensor.cpu().numpy().astype(np.float32)}
+
+    print(f"📦 Quantizing (static int8, {INT8_CALIBRATION_SAMPLES} calibration images) to {path}...")
+    _atomic_write(path, lambda tmp_path: quantize_static(
+        fp32_path, tmp_path, TensorReader(calibration_data(INT8_CALIBRATION_SAMPLES)),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    ))
+
+
+def onnx_cache_path(cache_prefix, variant):
+    """
+    Where a cached graph lives. The name carries the variant (backend and
+    its quantization settings), the opset and ONNX_EXPORT_VERSION, so a
+    change to any of them produces a new file rather than a stale hit.
+    """
+    return f"{cache_prefix}-{variant}-opset{ONNX_OPSET}-v{ONNX_EXPORT_VERSION}.onnx"
+
+
+def create_backend(name, net, device, cache_prefix=None, calibration_data=None):
+    """
+    Build the named backend around an already-loaded WSODModel.
+
+    ONNX graphs are written next to `cache_prefix` (see onnx_cache_path)
+    and reused on later starts. `calibration_data(limit)` yields
+    model-input tensors for int8_static.
+    """
+    if name not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name}. Choose from {', '.join(INFERENCE_BACKENDS)}")
+
+    if name == "eager":
+        return EagerBackend(net, device)
+    if name == "torchscript":
+        return TorchScriptBackend(net, device)
+    if name == "compile":
+        return CompiledBackend(net, device)
+
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        raise RuntimeError(f"INFERENCE_BACKEND={name} needs ONNX Runtime: pip install onnx onnxruntime")
+
+    if cache_prefix is None:
+        cache_prefix = os.path.join(tempfile.mkdtemp(prefix="wsod-onnx-"), "wsod_resnet50")
+
+    fp32_path = onnx_cache_path(cache_prefix, "fp32")
+    if not os.path.exists(fp32_path):
+        export_onnx(net, fp32_path)
+    if name == "onnx":
+        return OnnxRuntimeBackend(fp32_path, name)
+
+    fp32_path = prepare_for_quantization(fp32_path, onnx_cache_path(cache_prefix, "prep"))
+    if name == "int8_dynamic":
+        int8_path = onnx_cache_path(cache_prefix, "int8-dynamic")
+        if not os.path.exists(int8_path):
+            quantize_onnx_dynamic(fp32_path, int8_path)
+    else:
+        if calibration_data is None:
+            raise ValueError("int8_static needs calibration data")
+        int8_path = onnx_cache_path(cache_prefix, f"int8-static-{INT8_CALIBRATION_SAMPLES}")
+        if not os.path.exists(int8_path):
+            quantize_onnx_static(fp32_path, int8_path, calibration_data)
+    return OnnxRuntimeBackend(int8_path, name)
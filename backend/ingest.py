@@ -0,0 +1,171 @@
+import os
+import io
+import zlib
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from drive_cache import parse_mha_header, MAX_HEADER_BYTES
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# Uploads up to this size are decoded from memory; larger ones (and formats
+# that need a real file, e.g. DICOM) go through a temp file as before.
+INGEST_MAX_MEMORY_MB = float(os.getenv("INGEST_MAX_MEMORY_MB", "64"))
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff']
+# Every file type the pipeline reads (for endswith checks on names)
+SUPPORTED_EXTENSIONS = (".mha", ".mhd", ".dcm", ".dicom", *IMAGE_EXTENSIONS)
+DEFAULT_SPACING = (0.143, 0.143)  # what the file-based pipeline assumes for plain images
+
+MET_DTYPES = {
+    "MET_CHAR": np.int8, "MET_UCHAR": np.uint8, "MET_SHORT": np.int16, "MET_USHORT": np.uint16,
+    "MET_INT": np.int32, "MET_UINT": np.uint32, "MET_LONG": np.int64, "MET_ULONG": np.uint64,
+    "MET_LONG_LONG": np.int64, "MET_ULONG_LONG": np.uint64, "MET_FLOAT": np.float32, "MET_DOUBLE": np.float64,
+}
+
+# Computed / digital radiography (for presentation and for processing)
+RADIOGRAPHY_SOP_CLASSES = {"1.2.840.10008.5.1.4.1.1.1", "1.2.840.10008.5.1.4.1.1.1.1", "1.2.840.10008.5.1.4.1.1.1.1.1"}
+
+
+class NeedsFile(Exception):
+    """The upload cannot be decoded from memory; use spooled_file() and the file-based reader."""
+
+
+# ============================================================
+# IN-MEMORY DECODERS
+# ============================================================
+def decode_mha(data):
+    """
+    Decode a single-file MetaImage (.mha, raw or zlib-compressed) from bytes.
+    Returns (array, spacing) in the layout opencxr's read_file gives for the
+    same file: axes transposed to (x, y[, z]) and singleton axes squeezed.
+    Anything unusual (external data files, multi-channel pixels, header
+    offsets) raises NeedsFile so SimpleITK handles it instead.
+    """
+    try:
+        fields, header_size = parse_mha_header(data[:MAX_HEADER_BYTES])
+    except ValueError as e:
+        raise ValueError(f"Not a valid MetaImage file: {e}")
+
+    dtype = MET_DTYPES.get(fields.get("ElementType"))
+    if (dtype is None or fields.get("ElementDataFile") != "LOCAL"
+            or int(fields.get("ElementNumberOfChannels", "1")) != 1
+            or fields.get("HeaderSize", "0") not in ("0", "")):
+        raise NeedsFile("MetaImage layout not handled in memory")
+
+    dims = [int(d) for d in fields["DimSize"].split()]
+    big_endian = "True" in (fields.get("BinaryDataByteOrderMSB"), fields.get("ElementByteOrderMSB"))
+    dtype = np.dtype(dtype).newbyteorder(">" if big_endian else "<")
+
+    payload = memoryview(data)[header_size:]
+    if fields.get("CompressedData", "False") == "True":
+        payload = zlib.decompress(payload)
+    count = int(np.prod(dims))
+    if len(payload) < count * dtype.itemsize:
+        raise ValueError(f"Pixel data truncated ({len(payload)} of {count * dtype.itemsize} bytes)")
+
+    # Stored x fastest, so C order is (z, y, x) as in sitk.GetArrayFromImage
+    array = np.frombuffer(payload, dtype=dtype, count=count).reshape(dims[::-1])
+    array = array.astype(dtype.newbyteorder("="), copy=False)
+
+    spacing = [float(s) for s in fields.get("ElementSpacing", fields.get("ElementSize", "1 1")).split()]
+    return np.squeeze(np.transpose(array)), tuple(spacing[:2])
+
+
+def decode_dicom(data):
+    """
+    Decode an uncompressed single-frame grayscale DICOM from bytes, matching
+    opencxr's read_dicom: rescale slope/intercept applied, (x, y) layout.
+    Compressed transfer syntaxes (JPEG 2000 etc.) and files whose spacing
+    opencxr would take from other tags raise NeedsFile.
+    """
+    try:
+        import pydicom  # installed with opencxr
+    except ImportError:
+        raise NeedsFile("pydicom is not installed")
+    try:
+        dataset = pydicom.dcmread(io.BytesIO(data))
+    except Exception as e:
+        # e.g. InvalidDicomError for files without the preamble, which SimpleITK still reads
+        raise NeedsFile(f"pydicom could not read the file: {e}")
+    transfer_syntax = getattr(dataset, "file_meta", {}).get("TransferSyntaxUID")
+    if (transfer_syntax is None or transfer_syntax.is_compressed or "PixelData" not in dataset
+            or int(dataset.get("NumberOfFrames", 1)) != 1 or int(dataset.get("SamplesPerPixel", 1)) != 1):
+        raise NeedsFile("DICOM layout not handled in memory")
+
+    array = dataset.pixel_array
+    slope, intercept = float(dataset.get("RescaleSlope", 1)), float(dataset.get("RescaleIntercept", 0))
+    if slope != 1 or intercept != 0:
+        array = array * slope + intercept
+
+    # opencxr takes PixelSpacing as-is when ImagerPixelSpacing is absent; otherwise
+    # it keeps SimpleITK's spacing, which is ImagerPixelSpacing for CR/DX images
+    imager_spacing, pixel_spacing = dataset.get("ImagerPixelSpacing"), dataset.get("PixelSpacing")
+    if imager_spacing is None and pixel_spacing is not None:
+        spacing = tuple(float(s) for s in pixel_spacing)
+    elif imager_spacing is not None and str(dataset.get("SOPClassUID", "")) in RADIOGRAPHY_SOP_CLASSES:
+        spacing = tuple(float(s) for s in imager_spacing[::-1])  # (row, col) -> (x, y)
+    else:
+        raise NeedsFile("DICOM pixel spacing is resolved by SimpleITK")
+    return np.transpose(array), spacing
+
+
+def decode_image(data):
+    """Plain images (PNG, JPEG, ...) as a grayscale uint8 array, like Image.open(path).convert('L')."""
+    with Image.open(io.BytesIO(data)) as img:
+        return np.array(img.convert('L'))
+
+
+def decode_upload(data, filename):
+    """
+    Decode upload bytes for NODE21 standardization. Returns (array, spacing)
+    as the file-based reader would see them; raises NeedsFile for anything
+    that has to be read from disk (e.g. .mhd, whose pixels are a separate file).
+    """
+    file_extension = os.path.splitext(filename or "")[1].lower()
+    if file_extension == '.mha':
+        return decode_mha(data)
+    if file_extension in ['.dcm', '.dicom']:
+        return decode_dicom(data)
+    if file_extension in IMAGE_EXTENSIONS:
+        return decode_image(data), DEFAULT_SPACING
+    raise NeedsFile(f"{file_extension or 'files without an extension'} are read from disk")
+
+
+def decode_standardized(data, filename):
+    """
+    An image the client already standardized (e.g. the /preview image): a
+    2D uint8 array as .npy, or any grayscale-convertible image format.
+    """
+    if os.path.splitext(filename or "")[1].lower() == '.npy':
+        array = np.load(io.BytesIO(data), allow_pickle=False)
+    else:
+        try:
+            array = decode_image(data)
+        except UnidentifiedImageError:
+            raise ValueError("Standardized uploads must be 8-bit images (.png) or .npy arrays")
+    array = np.squeeze(array)
+    if array.ndim != 2 or array.dtype != np.uint8:
+        raise ValueError(f"Standardized uploads must be 2D uint8 images, got {array.dtype} {array.shape}")
+    return array
+
+
+# ============================================================
+# FALLBACK
+# ============================================================
+@contextmanager
+def spooled_file(data, filename):
+    """Write bytes to a temp file (keeping the extension) for the file-based readers; removed on exit."""
+    suffix = os.path.splitext(filename or "")[1]
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        yield path
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
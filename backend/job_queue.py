@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import shutil
+import socket
+import sqlite3
+import secrets
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# Job database and the uploaded inputs waiting to be scored
+JOB_DIR = os.getenv("JOB_DIR", os.path.join(os.getcwd(), "jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))  # jobs processed at once
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "1000"))  # queued jobs before submits are refused
+JOB_RETENTION_S = float(os.getenv("JOB_RETENTION_S", str(24 * 3600)))  # finished jobs kept this long
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "5"))
+# A running job whose worker has not checked in for this long is queued again
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "120"))
+JOB_HEARTBEAT_S = JOB_LEASE_S / 4
+
+FINISHED_STATUSES = ("done", "cancelled", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,          -- queued, running, done, cancelled, failed
+    model TEXT,
+    total INTEGER NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    owner TEXT,                    -- worker holding a running job
+    heartbeat REAL                 -- last time that worker checked in
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    status TEXT NOT NULL,          -- queued, done, error, cancelled
+    result TEXT,                   -- JSON
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created);
+"""
+# Columns added after the first release, for databases created before them
+MIGRATIONS = {"owner": "ALTER TABLE jobs ADD COLUMN owner TEXT",
+              "heartbeat": "ALTER TABLE jobs ADD COLUMN heartbeat REAL"}
+
+
+# ============================================================
+# PERSISTENT JOB STORE
+# ============================================================
+class JobStore:
+    """
+    Jobs and their per-file results in a local SQLite database.
+
+    Inputs are copied under `<directory>/<job_id>/` before a job is queued,
+    so queued work survives restarts. A running job is claimed by one store
+    (`owner`) that must call heartbeat() every JOB_HEARTBEAT_S; once its
+    claim is older than JOB_LEASE_S (the worker died or hung) the job is
+    queued again and resumes with its unscored files. Several processes can
+    share one directory. Methods block; call them from the I/O pool.
+    """
+
+    def __init__(self, directory=JOB_DIR, lease_s=JOB_LEASE_S):
+        self.directory = directory
+        self.lease_s = lease_s
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        os.makedirs(self.directory, exist_ok=True)
+        self.db_path = os.path.join(self.directory, "jobs.sqlite3")
+        db = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")  # status reads do not wait for workers' writes
+            db.executescript(SCHEMA)
+            columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    db.execute(statement)
+        finally:
+            db.close()
+
+    def _connect(self):
+        # One short-lived connection per call keeps the store safe to use from any thread
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return _Transaction(db)
+
+    # ---------------- submission ----------------
+    def new_job(self):
+        """A fresh job ID and the directory its inputs should be written to."""
+        job_id = secrets.token_hex(12)
+        input_dir = os.path.join(self.directory, job_id)
+        os.makedirs(input_dir)
+        return job_id, input_dir
+
+    def submit(self, job_id, files, model=None):
+        """Queue a job for `files`, a list of (name, path) already inside its input directory."""
+        with self._connect() as db:
+            db.execute("INSERT INTO jobs (id, status, model, total, created) VALUES (?, 'queued', ?, ?, ?)",
+                       (job_id, model, len(files), time.time()))
+            db.executemany("INSERT INTO job_items (job_id, idx, name, path, status) VALUES (?, ?, ?, ?, 'queued')",
+                           [(job_id, i, name, path) for i, (name, path) in enumerate(files)])
+
+    def discard(self, job_id):
+        """Remove a job's rows and inputs (failed submissions and expired jobs)."""
+        with self._connect() as db:
+            db.execute("DELETE FROM job_items WHERE job_id = ?", (job_id,))
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        shutil.rmtree(os.path.join(self.directory, job_id), ignore_errors=True)
+
+    def count_pending(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    # ---------------- workers ----------------
+    def claim_next(self):
+        """Re-queue stale claims, then claim the oldest queued job for this store and return its ID, or None."""
+        now = time.time()
+        with self._connect() as db:
+            # heartbeat is NULL for jobs left running by a version without leases
+            resumed = db.execute("UPDATE jobs SET status = 'queued', owner = NULL WHERE status = 'running' "
+                                 "AND COALESCE(heartbeat, 0) < ?", (now - self.lease_s,)).rowcount
+            row = db.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = 'running', started = COALESCE(started, ?), owner = ?, "
+                           "heartbeat = ? WHERE id = ?", (now, self.owner, now, row["id"]))
+        if resumed:
+            print(f"🔁 Re-queued {resumed} job(s) whose worker stopped checking in")
+        return None if row is None else row["id"]
+
+    def heartbeat(self, job_id):
+        """Renew this store's claim on a running job. False if the claim is gone (cancelled or re-queued)."""
+        with self._connect() as db:
+            return db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running' AND owner = ?",
+                              (time.time(), job_id, self.owner)).rowcount > 0
+
+    def pending_items(self, job_id):
+        """(idx, name, path) of the files in a job that still need scoring."""
+        with self._connect() as db:
+            rows = db.execute("SELECT idx, name, path FROM job_items WHERE job_id = ? AND status = 'queued' "
+                              "ORDER BY idx", (job_id,)).fetchall()
+        return [(row["idx"], row["name"], row["path"]) for row in rows]
+
+    def finish_item(self, job_id, idx, result):
+        """Store one file's result. False if it was not stored (cancelled, or the job changed hands)."""
+        status = "error" if "error" in result else "done"
+        with self._connect() as db:
+            return db.execute("UPDATE job_items SET status = ?, result = ? WHERE job_id = ? AND idx = ? AND status = 'queued' "
+                       "AND EXISTS (SELECT 1 FROM jobs WHERE id = ? AND owner = ?)",
+                       (status, json.dumps(result), job_id, idx, job_id, self.owner)).rowcount > 0
+
+    def holds(self, job_id):
+        """True while this store's claim on a running job is current (not cancelled or re-queued)."""
+        with self._connect() as db:
+            row = db.execute("SELECT status, owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is not None and row["status"] == "running" and row["owner"] == self.owner
+
+    def finish_job(self, job_id, error=None):
+        """Mark a running job done (or failed) and delete its inputs, unless another worker has taken it over."""
+        with self._connect() as db:
+            row = db.execute("SELECT owner FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            db.execute("UPDATE jobs SET status = ?, finished = ?, error = ? WHERE id = ? AND status = 'running' "
+                       "AND owner = ?", ("failed" if error else "done", time.time(), error, job_id, self.owner))
+        if row is not None and row["owner"] == self.owner:
+            shutil.rmtree(os.path.join(self.directory, job_id), ignore_errors=True)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Files already scored keep their results. Returns the new status."""
+        with self._connect() as db:
+            row = db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row["status"] in FINISHED_STATUSES:
+                return row["status"]
+            db.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ?", (time.time(), job_id))
+            db.execute("UPDATE job_items SET status = 'cancelled' WHERE job_id = ? AND status = 'queued'", (job_id,))
+        # A running job's worker notices between files; in-flight files finish first
+        if row["status"] == "queued":
+            shutil.rmtree(os.path.join(self.directory, job_id), ignore_errors=True)
+        return "cancelled"
+
+    def purge(self, retention_s=JOB_RETENTION_S):
+        """Delete finished jobs older than `retention_s`. Returns how many were removed."""
+        cutoff = time.time() - retention_s
+        with self._connect() as db:
+            rows = db.execute("SELECT id FROM jobs WHERE status IN (?, ?, ?) AND finished < ?",
+                              (*FINISHED_STATUSES, cutoff)).fetchall()
+        for row in rows:
+            self.discard(row["id"])
+        return len(rows)
+
+    # ---------------- reporting ----------------
+    def status(self, job_id):
+        """Job state with progress counts, or None if unknown."""
+        with self._connect() as db:
+            job = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status",
+                                     (job_id,)).fetchall())
+        done, errors = counts.get("done", 0), counts.get("error", 0)
+        status = {
+            "job_id": job["id"],
+            "status": job["status"],
+            "model": job["model"],
+            "total": job["total"],
+            "completed": done + errors,
+            "errors": errors,
+            "progress": round((done + errors) / job["total"], 4) if job["total"] else 1.0,
+            "created": job["created"],
+            "started": job["started"],
+            "finished": job["finished"],
+        }
+        if job["error"]:
+            status["error"] = job["error"]
+        return status
+
+    def results(self, job_id):
+        """Per-file results scored so far, in submission order."""
+        with self._connect() as db:
+            rows = db.execute("SELECT idx, name, status, result FROM job_items WHERE job_id = ? ORDER BY idx",
+                              (job_id,)).fetchall()
+        results = []
+        for row in rows:
+            item = {"index": row["idx"], "file": row["name"], "status": row["status"]}
+            if row["result"]:
+                item.update(json.loads(row["result"]))
+            results.append(item)
+        return results
+
+
+class _Transaction:
+    """`with` block around one connection: BEGIN IMMEDIATE, commit or roll back, close."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.db.close()
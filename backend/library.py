@@ -0,0 +1,83 @@
+import os
+import re
+import threading
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# The frontend's case list; its googleDriveId entries are the library
+LIBRARY_CASES_FILE = os.getenv(
+    "LIBRARY_CASES_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "data", "simulation_cases.js"),
+)
+# Comma-separated Drive IDs, for deployments that ship the backend without src/
+LIBRARY_IDS = os.getenv("LIBRARY_IDS", "")
+
+LIBRARY_PREWARM = os.getenv("LIBRARY_PREWARM", "1") != "0"
+LIBRARY_POLL_S = float(os.getenv("LIBRARY_POLL_S", "60"))  # 0 = prewarm once at startup
+
+DRIVE_ID_PATTERN = re.compile(r"""googleDriveId\s*:\s*["']([^"']+)["']""")
+
+
+# ============================================================
+# LIBRARY LIST
+# ============================================================
+def library_signature(path=LIBRARY_CASES_FILE):
+    """Cheap change marker for the case list (mtime + size), or None if it is missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def read_library_ids(path=LIBRARY_CASES_FILE):
+    """Drive IDs listed in simulation_cases.js plus LIBRARY_IDS, in order, without duplicates."""
+    ids = [i.strip() for i in LIBRARY_IDS.split(",") if i.strip()]
+    try:
+        with open(path, encoding="utf-8") as f:
+            ids.extend(DRIVE_ID_PATTERN.findall(f.read()))
+    except OSError:
+        pass
+    return list(dict.fromkeys(ids))
+
+
+# ============================================================
+# PRECOMPUTED RESULTS
+# ============================================================
+class LibraryStore:
+    """
+    Rendered predictions for library cases, kept in memory so library
+    requests skip download, standardization and inference entirely.
+    Results are stored with raw PNG bytes (render_prediction's
+    inline_images=False form); the server encodes them per request.
+    """
+
+    def __init__(self):
+        self._results = {}  # file_id -> result dict
+        self._lock = threading.Lock()
+
+    def get(self, file_id):
+        """A fresh copy of the stored result (callers mutate it), or None."""
+        with self._lock:
+            result = self._results.get(file_id)
+        return dict(result) if result is not None else None
+
+    def put(self, file_id, result):
+        with self._lock:
+            self._results[file_id] = dict(result)
+
+    def retain(self, file_ids):
+        """Drop cases that are no longer in the library."""
+        keep = set(file_ids)
+        with self._lock:
+            for file_id in [i for i in self._results if i not in keep]:
+                del self._results[file_id]
+
+    def __contains__(self, file_id):
+        with self._lock:
+            return file_id in self._results
+
+    def __len__(self):
+        with self._lock:
+            return len(self._results)
@@ -1,11 +1,32 @@
 import os
+import time
+import asyncio
 import importlib
-import gdown  # <--- NEW IMPORT
-from fastapi import FastAPI, UploadFile, File
+from contextlib import asynccontextmanager, nullcontext
+from fastapi import FastAPI, UploadFile, File, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+import json
+import zipfile
 import tempfile
 import shutil
+from typing import List
+
+import executor
+from executor import run_io, run_cpu
+from result_cache import file_sha256, bytes_sha256
+from session_store import SessionStore
+from drive_cache import DriveCache
+from image_store import (
+    ImageStore, IMAGE_FORMATS, IMAGE_CACHE_CONTROL, data_url_to_bytes, bytes_to_data_url, reencode_image,
+)
+from heatmap_render import RENDER_FORMATS, render_options_error
+from ingest import INGEST_MAX_MEMORY_MB, SUPPORTED_EXTENSIONS
+from admission import AdmissionMiddleware, build_gates
+from job_queue import JobStore, JOB_WORKERS, JOB_MAX_PENDING, JOB_RETENTION_S, JOB_POLL_S, JOB_HEARTBEAT_S
+from library import LibraryStore, LIBRARY_PREWARM, LIBRARY_POLL_S, library_signature, read_library_ids
+from metrics import REGISTRY, StageTimer, CACHE_EVENTS, UPLOAD_BYTES, record_timings, timings_ms
 
 # ============================================================
 # DYNAMIC MODULE LOADING
@@ -21,49 +42,559 @@ try:
         generate_preview = predictor_module.generate_preview
     else:
         generate_preview = None
+
+    # Optional split pipeline: CPU stages go to the CPU pool, PNG encoding to the I/O pool
+    run_prediction = getattr(predictor_module, 'run_prediction', None)
+    render_prediction = getattr(predictor_module, 'render_prediction', None)
+    prediction_summary = getattr(predictor_module, 'prediction_summary', None)
+    load_preview_array = getattr(predictor_module, 'load_preview_array', None)
+    numpy_to_base64 = getattr(predictor_module, 'numpy_to_base64', None)
+
+    # Optional upload-once support: /preview keeps the standardized array for /predict
+    run_prediction_from_array = getattr(predictor_module, 'run_prediction_from_array', None)
+    preview_is_standardized = getattr(predictor_module, 'preview_is_standardized', None)
+
+    # Optional in-memory ingestion: small uploads are decoded without a temp file
+    run_prediction_from_bytes = getattr(predictor_module, 'run_prediction_from_bytes', None)
+    load_preview_array_from_bytes = getattr(predictor_module, 'load_preview_array_from_bytes', None)
+
+    # Optional test-time augmentation: ?tta= scores several views of the image in one batch
+    parse_tta_views = getattr(predictor_module, 'parse_tta_views', None)
+
+    # Optional progressive results: /predict_stream sends the preview, prediction and heatmap as each is ready
+    run_preprocessing = getattr(predictor_module, 'run_preprocessing', None)
+    run_preprocessing_from_bytes = getattr(predictor_module, 'run_preprocessing_from_bytes', None)
+    run_inference = getattr(predictor_module, 'run_inference', None)
+    render_preview = getattr(predictor_module, 'render_preview', None)
+    render_heatmap = getattr(predictor_module, 'render_heatmap', None)
+    store_prediction = getattr(predictor_module, 'store_prediction', None)
+
+    # Optional multi-slice support: /predict_volume scores every slice of a study
+    run_volume_prediction = getattr(predictor_module, 'run_volume_prediction', None)
+
+    # Optional background loading: modules with warm_up() load their models lazily
+    warm_up = getattr(predictor_module, 'warm_up', None)
+
+    # Optional multi-model support: ?model= picks a registered model or "ensemble"
+    available_models = getattr(predictor_module, 'available_models', None)
 except Exception as e:
     raise RuntimeError(f"Failed to import {PREDICT_MODULE}: {e}")
 
 # ============================================================
 # CONFIGURATION
 # ============================================================
-# We will download Google Drive files into this temp folder
-CACHE_DIR = os.path.join(os.getcwd(), "google_drive_cache")
-os.makedirs(CACHE_DIR, exist_ok=True)
+# Google Drive library cases are downloaded once into DRIVE_CACHE_DIR (see drive_cache.py)
+drive_cache = DriveCache()
 
 class LibraryRequest(BaseModel):
     file_id: str  # We now expect a Google Drive ID, not a filename
 
+# Standardized images from /preview, looked up by handle in /predict
+preview_sessions = SessionStore()
+
+# Library cases precomputed in the background (see prewarm_library)
+library_store = LibraryStore()
+
+# Model loading state reported by /readyz
+readiness = {"ready": warm_up is None, "error": None, "load_seconds": None}
+
+# Rendered images served from /images when a client asks for ?images=url
+image_store = ImageStore()
+IMAGE_RESULT_KEYS = ("preview_image", "original_image")
+
+# /predict_batch limits. Files in flight at once: enough to fill the CPU pool
+# and let the micro-batcher group their forward passes.
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+BATCH_MAX_ZIP_MB = float(os.getenv("BATCH_MAX_ZIP_MB", "2048"))  # uncompressed total
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(executor.CPU_POOL_SIZE * 2)))
+
+# Admission control: POST paths -> gate names (limits in admission.py)
+ADMISSION_PATHS = {
+    "/predict": "predict",
+    "/predict_from_library": "predict_from_library",
+    "/preview": "preview",
+    "/preview_from_library": "preview_from_library",
+    "/predict_batch": "predict_batch",
+    "/predict_stream": "predict_stream",
+    "/predict_volume": "predict_volume",
+    "/jobs": "jobs",
+}
+admission_gates = build_gates(ADMISSION_PATHS.values())
+
+# Background jobs (/jobs), persisted in JOB_DIR; see job_queue.py
+job_store = JobStore()
+job_wakeup = asyncio.Event()  # set on submit so idle workers start at once
+
+# ============================================================
+# METRICS
+# ============================================================
+HTTP_SECONDS = REGISTRY.histogram(
+    "nodule_http_request_seconds", "End-to-end request latency.", ["method", "route", "status"])
+if hasattr(predictor_module, "queue_depth"):
+    REGISTRY.gauge("nodule_batch_queue_depth", "Requests waiting for the micro-batchers.",
+                   callback=predictor_module.queue_depth)
+REGISTRY.gauge("nodule_model_ready", "1 once the model is loaded and warmed up.",
+               callback=lambda: int(readiness["ready"]))
+REGISTRY.gauge("nodule_library_cases_ready", "Library cases answered from memory.",
+               callback=lambda: len(library_store))
+REGISTRY.gauge("nodule_preview_sessions", "Live /preview session handles.", callback=lambda: len(preview_sessions))
+REGISTRY.gauge("nodule_jobs_queued", "Jobs waiting for a job worker.", callback=job_store.count_pending)
+
 # ============================================================
 # HELPER: DOWNLOAD FROM GOOGLE DRIVE
 # ============================================================
 def get_file_from_drive(file_id: str):
     """
     Downloads file from Google Drive using ID.
-    Caches it locally so we don't download it twice.
+    Caches it locally so we don't download it twice; concurrent requests
+    for the same ID share one download. Returns None on failure. The file
+    stays pinned in the cache until drive_cache.release(file_id); use
+    drive_file() from async code.
     """
-    # Create a consistent filename based on ID
-    output_path = os.path.join(CACHE_DIR, f"{file_id}.mha")
-    
-    # If we already downloaded it, skip download! (Faster)
-    if os.path.exists(output_path):
-        print(f"📂 Found cached file: {output_path}")
-        return output_path
+    return drive_cache.fetch(file_id)
+
+@asynccontextmanager
+async def drive_file(file_id: str, timer: StageTimer = None):
+    """
+    `async with drive_file(file_id) as path:` a library case (None on failure),
+    pinned in the Drive cache until the block exits, even if the request is
+    cancelled while the download is still running.
+    """
+    fetch = asyncio.ensure_future(run_io(get_file_from_drive, file_id))
+
+    def release(done):
+        if not done.cancelled() and done.exception() is None and done.result():
+            executor.get_io_pool().submit(drive_cache.release, file_id)
+
+    try:
+        with timer.stage("drive_fetch") if timer else nullcontext():
+            # A cancelled request stops waiting here; the download itself carries on
+            path = await asyncio.shield(fetch)
+        yield path
+    finally:
+        fetch.add_done_callback(release)
+
+# ============================================================
+# HELPER: UPLOADS
+# ============================================================
+def save_upload_to_temp(upload: UploadFile, endpoint: str = "predict", directory: str = None):
+    """Copy an upload to a temp file (blocking; run it in the I/O pool)."""
+    suffix = upload.filename.split('.')[-1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{suffix}", dir=directory) as tmp:
+        shutil.copyfileobj(upload.file, tmp)
+        UPLOAD_BYTES.observe(tmp.tell(), endpoint=endpoint)
+        return tmp.name
+
+def read_upload(upload: UploadFile, endpoint: str = "predict", max_bytes: float = None):
+    """
+    The upload's bytes (blocking; run it in the I/O pool), or None if it is
+    larger than INGEST_MAX_MEMORY_MB and should be copied to a temp file instead.
+    """
+    max_bytes = INGEST_MAX_MEMORY_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    size = upload.size
+    if size is None:
+        # Chunked uploads have no declared size; measure the spooled file instead
+        upload.file.seek(0, 2)
+        size = upload.file.tell()
+    if size > max_bytes:
+        return None
+    upload.file.seek(0)
+    data = upload.file.read()
+    UPLOAD_BYTES.observe(len(data), endpoint=endpoint)
+    return data
+
+def remove_file(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+def is_supported_image(name: str):
+    return name.lower().endswith(SUPPORTED_EXTENSIONS)
+
+def list_zip_images(archive: zipfile.ZipFile):
+    """Image members of a zip, rejecting archives over the file count or size limits."""
+    members = [
+        info for info in archive.infolist()
+        if not info.is_dir() and is_supported_image(info.filename)
+        and not os.path.basename(info.filename).startswith(".")  # macOS resource forks
+    ]
+    if len(members) > BATCH_MAX_FILES:
+        raise ValueError(f"Archive has {len(members)} images; the limit is {BATCH_MAX_FILES}.")
+    total = sum(info.file_size for info in members)
+    if total > BATCH_MAX_ZIP_MB * 1024 * 1024:
+        raise ValueError(f"Archive expands to {total / 1e6:.0f} MB; the limit is {BATCH_MAX_ZIP_MB:.0f} MB.")
+    return members
+
+def extract_zip_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, endpoint: str = "predict_batch",
+                       directory: str = None):
+    """Copy one zip member to a temp file (blocking). Only the extension of its name is used."""
+    suffix = os.path.splitext(info.filename)[1]
+    with archive.open(info) as src, tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=directory) as tmp:
+        shutil.copyfileobj(src, tmp)
+        UPLOAD_BYTES.observe(tmp.tell(), endpoint=endpoint)
+        return tmp.name
+
+async def open_batch_inputs(files: List[UploadFile], archive: UploadFile):
+    """
+    (name, source) pairs for several uploads or one zip archive, plus the open
+    ZipFile (or None). Sources are UploadFiles or ZipInfos; see copy_batch_input.
+    Raises ValueError with a client-facing message.
+    """
+    zip_file = None
+    if archive is not None:
+        try:
+            zip_file = await run_io(zipfile.ZipFile, archive.file)
+            items = [(info.filename, info) for info in await run_io(list_zip_images, zip_file)]
+        except (zipfile.BadZipFile, ValueError) as e:
+            if zip_file is not None:
+                zip_file.close()
+            raise ValueError(f"Invalid archive: {e}")
+    else:
+        items = [(upload.filename, upload) for upload in files or []]
+    if not items:
+        raise ValueError("No image files provided.")
+    if len(items) > BATCH_MAX_FILES:
+        raise ValueError(f"Too many files ({len(items)}); the limit is {BATCH_MAX_FILES}.")
+    return items, zip_file
+
+async def copy_batch_input(source, zip_file, endpoint: str, directory: str = None):
+    """Write one item from open_batch_inputs to a file and return its path."""
+    if zip_file is not None:
+        return await run_io(extract_zip_member, zip_file, source, endpoint, directory)
+    return await run_io(save_upload_to_temp, source, endpoint, directory)
+
+# ============================================================
+# OFF-LOOP PIPELINE
+# ============================================================
+async def run_predict(image_path: str, inline_images: bool = True, model_name: str = None, render: dict = None,
+                      tta: list = None):
+    """Run predict_image without blocking the event loop."""
+    # Only pass model_name / tta on when chosen (single-model modules don't take them)
+    model_args = (model_name,) if model_name else ()
+    if run_prediction and render_prediction:
+        raw = await run_cpu(run_prediction, image_path, *model_args, **tta_args(tta))
+        return await run_io(render_prediction, raw, inline_images, **(render or {}))
+    return await run_cpu(predict_image, image_path, *model_args)
 
-    print(f"⬇️ Downloading from Google Drive (ID: {file_id})...")
+async def run_preview(image_path: str):
+    """Run generate_preview without blocking the event loop."""
+    if load_preview_array and numpy_to_base64:
+        try:
+            preview_array = await run_cpu(load_preview_array, image_path)
+            return await run_io(numpy_to_base64, preview_array)
+        except Exception as e:
+            print(f"Preview generation failed: {str(e)}")
+            return None
+    return await run_cpu(generate_preview, image_path)
+
+async def run_preview_bytes(data: bytes, filename: str):
+    """run_preview for an upload held in memory."""
+    try:
+        preview_array = await run_cpu(load_preview_array_from_bytes, data, filename)
+        return await run_io(numpy_to_base64, preview_array)
+    except Exception as e:
+        print(f"Preview generation failed: {str(e)}")
+        return None
+
+async def run_preview_session(image_path: str = None, data: bytes = None, filename: str = None):
+    """
+    Preview a standardized upload and keep the array so /predict can reuse it.
+    Takes a temp file path, or the upload's bytes and filename.
+    """
     try:
-        # gdown handles the messy Google Drive URL logic for us
-        url = f'https://drive.google.com/uc?id={file_id}'
-        gdown.download(url, output_path, quiet=False)
-        return output_path
+        if data is not None:
+            content_hash = bytes_sha256(data)
+            std_img = await run_cpu(load_preview_array_from_bytes, data, filename)
+        else:
+            content_hash = await run_io(file_sha256, image_path)
+            std_img = await run_cpu(load_preview_array, image_path)
+        preview_image = await run_io(numpy_to_base64, std_img)
     except Exception as e:
-        print(f"❌ Download failed: {e}")
+        print(f"Preview generation failed: {str(e)}")
+        return {"preview_image": None}
+
+    handle = preview_sessions.put({"std_img": std_img, "content_hash": content_hash})
+    return {"preview_image": preview_image, "handle": handle}
+
+async def run_predict_bytes(data: bytes, filename: str, inline_images: bool = True, model_name: str = None,
+                            render: dict = None, standardized: bool = False, tta: list = None):
+    """run_predict for an upload held in memory (no temp file)."""
+    raw = await run_cpu(run_prediction_from_bytes, data, filename, model_name, standardized, **tta_args(tta))
+    return await run_io(render_prediction, raw, inline_images, **(render or {}))
+
+async def run_predict_summary(image_path: str, model_name: str = None):
+    """Prediction fields only: skips heatmap rendering and PNG encoding."""
+    model_args = (model_name,) if model_name else ()
+    if run_prediction and prediction_summary:
+        return await run_io(prediction_summary, await run_cpu(run_prediction, image_path, *model_args))
+    result = await run_cpu(predict_image, image_path, *model_args)
+    for key in IMAGE_RESULT_KEYS:
+        result.pop(key, None)
+    return result
+
+async def run_predict_from_session(session: dict, inline_images: bool = True, model_name: str = None,
+                                   render: dict = None, tta: list = None):
+    """Predict on an image /preview already standardized (no upload, no opencxr)."""
+    raw = await run_cpu(run_prediction_from_array, session["std_img"], session["content_hash"], model_name,
+                        **tta_args(tta))
+    return await run_io(render_prediction, raw, inline_images, **(render or {}))
+
+# ============================================================
+# MODEL SELECTION
+# ============================================================
+def check_model(model: str):
+    """Error message for an unknown ?model=, else None."""
+    if model is None:
         return None
+    names = available_models() if available_models else []
+    if model not in names:
+        return f"Unknown model '{model}'. Available: {', '.join(names) or 'none (single-model server)'}"
+    return None
+
+# ============================================================
+# TEST-TIME AUGMENTATION
+# ============================================================
+def tta_views(tta: str):
+    """
+    View names for ?tta= (true for the TTA_VIEWS default, or a comma-separated
+    list), or None without TTA. Raises ValueError for unknown views.
+    """
+    if parse_tta_views is None:
+        if tta in (None, "", "false", "0"):
+            return None
+        raise ValueError("Test-time augmentation is not available with this predictor.")
+    return parse_tta_views(tta)
+
+def tta_args(tta: list):
+    """Keyword arguments passing the views on to the predictor, if any."""
+    return {"tta": tta} if tta else {}
+
+# ============================================================
+# RENDERING OPTIONS
+# ============================================================
+def render_options(size: str, image_format: str, quality: int):
+    """
+    render_prediction keyword arguments for ?size=&format=&quality=, or {}
+    for the default full-size PNGs (which are cached and prewarmed).
+    Raises ValueError for unsupported values.
+    """
+    if error := render_options_error(size, image_format, quality):
+        raise ValueError(error)
+    if size == "full" and image_format == "png" and quality is None:
+        return {}
+    return {"size": size, "image_format": image_format, "quality": quality}
+
+# ============================================================
+# IMAGE URLS (alternative to inline base64)
+# ============================================================
+def wants_inline_images(images: str):
+    return images != "url"
+
+def etag_matches(if_none_match: str, etag: str):
+    """True if an If-None-Match header lists this exact entity tag (or is *)."""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"') == etag:
+            return True
+    return False
+
+def publish_images(result: dict, request: Request):
+    """Move rendered images into the image store and replace them with URLs."""
+    if "error" in result:
+        return result
+    for key in IMAGE_RESULT_KEYS:
+        value = result.get(key)
+        if isinstance(value, str) and value.startswith("data:"):
+            # Predictor modules without a bytes mode still return data URLs
+            value = data_url_to_bytes(value)
+        if isinstance(value, (bytes, bytearray)):
+            image_id = image_store.put(bytes(value), result.get("image_type", "image/png"))
+            result[key] = str(request.url_for("get_image", image_id=image_id))
+    return result
+
+def inline_result_images(result: dict):
+    """Turn raw PNG bytes in a result into data URLs (the default response form)."""
+    for key in IMAGE_RESULT_KEYS:
+        if isinstance(result.get(key), (bytes, bytearray)):
+            result[key] = bytes_to_data_url(bytes(result[key]))
+    return result
+
+def shape_stream_images(event: dict, request: Request, inline: bool):
+    """Image bytes in a /predict_stream update -> data URLs (inline) or /images URLs."""
+    if not inline:
+        return publish_images(event, request)
+    for key in IMAGE_RESULT_KEYS:
+        if isinstance(event.get(key), (bytes, bytearray)):
+            event[key] = bytes_to_data_url(bytes(event[key]), event.get("image_type", "image/png"))
+    return event
+
+def stream_line(event: dict, sse: bool):
+    """One /predict_stream update as an NDJSON line, or as a Server-Sent Event named after its type."""
+    data = json.dumps(event)
+    if sse:
+        return f"event: {event['event']}\ndata: {data}\n\n"
+    return data + "\n"
+
+def finish_result(result, timer: StageTimer, request: Request, inline: bool, timings: bool):
+    """Record stage timings, then shape the response (image URLs, optional timings field)."""
+    if isinstance(result, dict):
+        timer.timings.update(result.pop("timings", None) or {})
+    record_timings(timer.timings)
+    if not inline:
+        result = publish_images(result, request)
+    if timings and isinstance(result, dict):
+        result["timings"] = timings_ms(timer.timings)
+    return result
 
 # ============================================================
 # FASTAPI APP
 # ============================================================
-app = FastAPI()
+async def load_predictor():
+    """Load and warm up the model in the CPU pool while the server already accepts connections."""
+    start = time.perf_counter()
+    try:
+        await run_cpu(warm_up)
+    except Exception as e:
+        readiness["error"] = str(e)
+        print(f"❌ Model loading failed: {e}")
+        return False
+    readiness["load_seconds"] = round(time.perf_counter() - start, 3)
+    readiness["ready"] = True
+    print(f"✅ Model ready in {readiness['load_seconds']}s")
+    return True
+
+async def prewarm_library_case(file_id: str):
+    """Fetch, standardize, score and render one library case into library_store."""
+    async with drive_file(file_id) as file_path:
+        if not file_path:
+            return
+        result = await run_predict(file_path, inline_images=False)
+    if "error" in result:
+        print(f"⚠️ Library prewarm failed for {file_id}: {result['error']}")
+        return
+    result.pop("timings", None)
+    library_store.put(file_id, result)
+
+async def prewarm_library():
+    """
+    Precompute every library case once the model is ready, then poll the
+    case list and prewarm again whenever it changes.
+    """
+    signature = object()
+    while True:
+        current = library_signature()
+        if current != signature:
+            signature = current
+            file_ids = read_library_ids()
+            library_store.retain(file_ids)
+            start = time.perf_counter()
+            for file_id in file_ids:
+                if file_id not in library_store:
+                    try:
+                        await prewarm_library_case(file_id)
+                    except Exception as e:
+                        print(f"⚠️ Library prewarm failed for {file_id}: {e}")
+            print(f"📚 Library prewarmed: {len(library_store)}/{len(file_ids)} case(s) "
+                  f"in {time.perf_counter() - start:.1f}s")
+        if LIBRARY_POLL_S <= 0:
+            return
+        await asyncio.sleep(LIBRARY_POLL_S)
+
+async def run_job(job_id: str):
+    """Score a job's remaining files, BATCH_CONCURRENCY at a time, storing each result as it lands."""
+    model = (await run_io(job_store.status, job_id))["model"]
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def keep_claim():
+        # Stop renewing once the job is cancelled or another worker took it over
+        while await run_io(job_store.heartbeat, job_id):
+            await asyncio.sleep(JOB_HEARTBEAT_S)
+
+    async def score(idx, name, path):
+        async with slots:
+            if not await run_io(job_store.holds, job_id):
+                return
+            try:
+                result = await run_predict_summary(path, model)
+                record_timings(result.pop("timings", None) or {})
+            except Exception as e:
+                result = {"error": str(e)}
+            # A worker that took the job over still needs the input
+            if await run_io(job_store.finish_item, job_id, idx, result):
+                await run_io(remove_file, path)
+
+    heartbeat = asyncio.create_task(keep_claim())
+    try:
+        items = await run_io(job_store.pending_items, job_id)
+        await asyncio.gather(*(score(*item) for item in items))
+    finally:
+        heartbeat.cancel()
+    await run_io(job_store.finish_job, job_id)
+
+async def job_worker():
+    """Take queued jobs one at a time until the server stops."""
+    while True:
+        job_wakeup.clear()
+        job_id = await run_io(job_store.claim_next)
+        if job_id is None:
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), JOB_POLL_S)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        start = time.perf_counter()
+        try:
+            await run_job(job_id)
+            print(f"✅ Job {job_id} finished in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            print(f"❌ Job {job_id} failed: {e}")
+            await run_io(job_store.finish_job, job_id, str(e))
+
+async def purge_jobs():
+    """Delete finished jobs once they are older than JOB_RETENTION_S."""
+    while True:
+        removed = await run_io(job_store.purge)
+        if removed:
+            print(f"🗑️ Removed {removed} expired job(s)")
+        await asyncio.sleep(max(60.0, min(JOB_RETENTION_S, 3600.0)))
+
+async def start_background_jobs():
+    if warm_up and not await load_predictor():
+        return
+    tasks = [job_worker() for _ in range(JOB_WORKERS)] + [purge_jobs()]
+    if LIBRARY_PREWARM and run_prediction and render_prediction:
+        tasks.append(prewarm_library())
+    await asyncio.gather(*tasks)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the CPU pool now so process workers load the model before traffic arrives
+    executor.get_cpu_pool(preload_modules=[PREDICT_MODULE])
+    background = asyncio.create_task(start_background_jobs())
+    yield
+    background.cancel()
+    executor.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Admission control: limit concurrent requests per inference endpoint (see admission.py)
+app.add_middleware(AdmissionMiddleware, paths=ADMISSION_PATHS, gates=admission_gates)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template (e.g. /images/{image_id}) to keep cardinality bounded.
+    # Requests refused by admission control never reach a route; their paths are fixed.
+    route = getattr(request.scope.get("route"), "path", None)
+    if route is None:
+        route = request.url.path if request.url.path in ADMISSION_PATHS else "unmatched"
+    HTTP_SECONDS.observe(time.perf_counter() - start, method=request.method,
+                         route=route, status=response.status_code)
+    return response
 
 app.add_middleware(
     CORSMiddleware,
@@ -75,65 +606,487 @@ app.add_middleware(
 
 @app.post("/preview_from_library")
 async def preview_from_library(payload: LibraryRequest):
+    # 0. Prewarmed library case: the preview is the standardized image already rendered
+    cached = library_store.get(payload.file_id)
+    CACHE_EVENTS.inc(cache="library", result="miss" if cached is None else "hit")
+    if cached is not None:
+        return {"preview_image": bytes_to_data_url(cached["original_image"])}
+
     # 1. Download/Get File
-    file_path = get_file_from_drive(payload.file_id)
-    
-    if not file_path:
-        return {"error": "Failed to download file from Google Drive."}
+    timer = StageTimer()
+    async with drive_file(payload.file_id, timer) as file_path:
+        record_timings(timer.timings)
+
+        if not file_path:
+            return {"error": "Failed to download file from Google Drive."}
 
-    # 2. Generate Preview
+        # 2. Generate Preview
+        try:
+            if generate_preview:
+                preview_image = await run_preview(file_path)
+                return {"preview_image": preview_image}
+            return {"error": "Preview generator not loaded"}
+        except Exception as e:
+            return {"error": str(e)}
+
+@app.post("/predict_from_library")
+async def predict_from_library(payload: LibraryRequest, request: Request, images: str = "inline",
+                               timings: bool = False, model: str = None,
+                               size: str = "full", format: str = "png", quality: int = None, tta: str = None):
+    if error := check_model(model):
+        return {"error": error}
     try:
-        if generate_preview:
-            preview_image = generate_preview(file_path)
-            return {"preview_image": preview_image}
-        return {"error": "Preview generator not loaded"}
-    except Exception as e:
+        render = render_options(size, format, quality)
+        views = tta_views(tta)
+    except ValueError as e:
         return {"error": str(e)}
+    inline = wants_inline_images(images)
+    timer = StageTimer()
+
+    # 0. Prewarmed library case (precomputed with the default model and rendering)
+    result = None
+    if not render and not views and (model is None or (available_models and model == available_models()[0])):
+        with timer.stage("library_lookup"):
+            result = library_store.get(payload.file_id)
+        CACHE_EVENTS.inc(cache="library", result="miss" if result is None else "hit")
+    if result is not None:
+        if inline:
+            inline_result_images(result)
+        return finish_result(result, timer, request, inline, timings)
 
-@app.post("/predict_from_library")
-async def predict_from_library(payload: LibraryRequest):
     # 1. Download/Get File
-    file_path = get_file_from_drive(payload.file_id)
-    
-    if not file_path:
-        return {"error": "Failed to download file from Google Drive."}
+    async with drive_file(payload.file_id, timer) as file_path:
+        if not file_path:
+            record_timings(timer.timings)
+            return {"error": "Failed to download file from Google Drive."}
 
-    # 2. Predict
-    try:
-        result = predict_image(file_path)
-        return result
-    except Exception as e:
-        return {"error": str(e)}
+        # 2. Predict
+        try:
+            result = await run_predict(file_path, inline, model, render, views)
+            return finish_result(result, timer, request, inline, timings)
+        except Exception as e:
+            return {"error": str(e)}
 
 # ... (Keep your existing @app.post("/predict") and @app.post("/preview") logic here for local uploads) ...
 @app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    suffix = file.filename.split('.')[-1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{suffix}") as tmp:
-        shutil.copyfileobj(file.file, tmp)
-        temp_path = tmp.name
+async def predict(request: Request, file: UploadFile = File(None), handle: str = Form(None),
+                  images: str = "inline", timings: bool = False, model: str = None,
+                  size: str = "full", format: str = "png", quality: int = None, standardized: bool = False,
+                  tta: str = None):
+    # images=inline (default): base64 data URLs; images=url: links to /images
+    # timings=true adds per-stage milliseconds to the response
+    # model=<name> or model=ensemble picks the classifier (see GET /models)
+    # size=thumbnail|screen|full, format=png|jpeg|webp, quality=1-100 shrink the rendered images
+    # standardized=true: the file is an already-standardized 8-bit image (.png or .npy), classified as-is
+    # tta=true (or a list such as tta=identity,hflip) averages augmented views scored in one batch
+    if error := check_model(model):
+        return {"error": error}
+    if standardized and not (run_prediction_from_bytes and render_prediction):
+        return {"error": "Standardized uploads are not supported by this predictor."}
+    try:
+        render = render_options(size, format, quality)
+        views = tta_views(tta)
+    except ValueError as e:
+        return {"error": str(e)}
+    inline = wants_inline_images(images)
+    timer = StageTimer()
+
+    # Reuse the image uploaded to /preview when the client sends its handle
+    if handle:
+        session = preview_sessions.get(handle)
+        CACHE_EVENTS.inc(cache="session", result="miss" if session is None else "hit")
+        if session is None:
+            return {"error": "Preview session expired. Please upload the file again.", "session_expired": True}
+        result = await run_predict_from_session(session, inline, model, render, views)
+        return finish_result(result, timer, request, inline, timings)
+
+    if file is None:
+        return {"error": "No file or preview handle provided."}
+
+    # Small uploads are decoded straight from memory
+    if run_prediction_from_bytes and render_prediction:
+        with timer.stage("upload_read"):
+            # Standardized images are at most a few MB; always take them in memory
+            data = await run_io(read_upload, file, "predict", float("inf") if standardized else None)
+        if data is not None:
+            result = await run_predict_bytes(data, file.filename, inline, model, render, standardized, views)
+            return finish_result(result, timer, request, inline, timings)
+
+    with timer.stage("upload_copy"):
+        temp_path = await run_io(save_upload_to_temp, file, "predict")
     try:
-        result = predict_image(temp_path)
+        result = await run_predict(temp_path, inline, model, render, views)
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-    return result
+        await run_io(remove_file, temp_path)
+    return finish_result(result, timer, request, inline, timings)
+
+@app.post("/predict_stream")
+async def predict_stream(request: Request, file: UploadFile = File(None), handle: str = Form(None),
+                         images: str = "inline", timings: bool = False, model: str = None,
+                         size: str = "full", format: str = "png", quality: int = None, tta: str = None):
+    """
+    /predict as a stream of updates, each sent as soon as it is ready:
+    `preview` (the standardized image) and `prediction` (prediction,
+    confidence and the other summary fields) in the order they finish,
+    then `heatmap`, then `done`; or `error`.
+    NDJSON by default, Server-Sent Events with `Accept: text/event-stream`.
+    Takes the same file/handle and query parameters as /predict.
+    """
+    if not (run_preprocessing and run_preprocessing_from_bytes and run_inference
+            and render_preview and render_heatmap and store_prediction and prediction_summary):
+        return {"error": "Streaming is not available with this predictor."}
+    if error := check_model(model):
+        return {"error": error}
+    try:
+        render = render_options(size, format, quality)
+        views = tta_views(tta)
+    except ValueError as e:
+        return {"error": str(e)}
+    inline = wants_inline_images(images)
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    timer = StageTimer()
+
+    # Take the input before streaming starts; the upload is closed after this handler returns
+    session, data, temp_path = None, None, None
+    if handle:
+        session = preview_sessions.get(handle)
+        CACHE_EVENTS.inc(cache="session", result="miss" if session is None else "hit")
+        if session is None:
+            return {"error": "Preview session expired. Please upload the file again.", "session_expired": True}
+    elif file is None:
+        return {"error": "No file or preview handle provided."}
+    else:
+        with timer.stage("upload_read"):
+            data = await run_io(read_upload, file, "predict_stream")
+        if data is None:
+            with timer.stage("upload_copy"):
+                temp_path = await run_io(save_upload_to_temp, file, "predict_stream")
+    filename = file.filename if file is not None else None
+    image_type = {} if format == "png" else {"image_type": RENDER_FORMATS[format]}
+
+    async def stream():
+        nonlocal temp_path
+        inference, updates, rendered = None, [], {}
+        try:
+            # 1. Standardize (a cache hit already carries everything)
+            if session is not None:
+                staged = {"std_img": session["std_img"]}
+                inference = asyncio.ensure_future(run_cpu(
+                    run_prediction_from_array, session["std_img"], session["content_hash"], model, **tta_args(views)))
+            else:
+                try:
+                    if data is not None:
+                        staged = await run_cpu(run_preprocessing_from_bytes, data, filename, model,
+                                               **tta_args(views))
+                    else:
+                        staged = await run_cpu(run_preprocessing, temp_path, model, **tta_args(views))
+                finally:
+                    if temp_path:
+                        await run_io(remove_file, temp_path)
+                        temp_path = None
+                if "error" in staged:
+                    yield stream_line({"event": "error", "error": staged["error"]}, sse)
+                    return
+                inference = asyncio.ensure_future(run_cpu(run_inference, staged, model, **tta_args(views)))
+
+            # 2. Preview (encoded while the model runs) and prediction, each sent
+            # as soon as it is ready; the preview usually comes first
+            async def preview_update():
+                with timer.stage("encode"):
+                    rendered["preview_png"] = await run_io(render_preview, staged, **render)
+                return {"event": "preview", "original_image": rendered["preview_png"], **image_type}
+
+            async def prediction_update():
+                summary = await run_io(prediction_summary, await inference)
+                if "error" in summary:
+                    return {"event": "error", "error": summary["error"]}
+                summary.pop("timings", None)
+                return {"event": "prediction", **summary}
+
+            updates = [asyncio.ensure_future(preview_update()), asyncio.ensure_future(prediction_update())]
+            for next_done in asyncio.as_completed(updates):
+                event = await next_done
+                yield stream_line(shape_stream_images(event, request, inline), sse)
+                if event["event"] == "error":
+                    return
+
+            # 3. Heatmap last
+            raw = inference.result()
+            heatmap = await run_io(render_heatmap, raw, **render)
+            if "error" in heatmap:
+                yield stream_line({"event": "error", "error": heatmap["error"]}, sse)
+                return
+            for stage, seconds in heatmap.pop("timings", {}).items():
+                timer.timings[stage] = timer.timings.get(stage, 0.0) + seconds
+            heatmap_png = heatmap["preview_image"]
+            yield stream_line(shape_stream_images({"event": "heatmap", **heatmap}, request, inline), sse)
+
+            # The cache entry is written once the client has everything
+            await run_io(store_prediction, raw, timer, rendered["preview_png"], heatmap_png, not render)
+            done = {"event": "done"}
+            if timings:
+                done["timings"] = timings_ms(timer.timings)
+            yield stream_line(done, sse)
+        except Exception as e:
+            # Any failure mid-stream ends with the documented error event, not a cut connection
+            yield stream_line({"event": "error", "error": str(e)}, sse)
+        finally:
+            # Client went away (or an update failed): drop what is still running
+            for task in updates + [inference]:
+                if task is not None:
+                    task.cancel()
+            if temp_path:
+                await run_io(remove_file, temp_path)
+            record_timings(timer.timings)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # keep proxies from buffering updates
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type, headers=headers)
+
+@app.post("/predict_volume")
+async def predict_volume(request: Request, file: UploadFile = File(...), images: str = "inline",
+                         timings: bool = False, model: str = None,
+                         size: str = "full", format: str = "png", quality: int = None):
+    """
+    Score every slice of a multi-slice .mha/.mhd/DICOM study in batched passes.
+    Returns the study result (positive if any slice is), per-slice scores under
+    `slices`, and the heatmap of the most suspicious slice (`key_slice`).
+    """
+    if not (run_volume_prediction and render_prediction):
+        return {"error": "Multi-slice prediction is not available with this predictor."}
+    if error := check_model(model):
+        return {"error": error}
+    try:
+        render = render_options(size, format, quality)
+    except ValueError as e:
+        return {"error": str(e)}
+    inline = wants_inline_images(images)
+    timer = StageTimer()
+
+    with timer.stage("upload_copy"):
+        temp_path = await run_io(save_upload_to_temp, file, "predict_volume")
+    try:
+        model_args = (model,) if model else ()
+        raw = await run_cpu(run_volume_prediction, temp_path, *model_args)
+        result = await run_io(render_prediction, raw, inline, **render)
+    finally:
+        await run_io(remove_file, temp_path)
+    return finish_result(result, timer, request, inline, timings)
+
+@app.post("/predict_batch")
+async def predict_batch(request: Request, files: List[UploadFile] = File(None), archive: UploadFile = File(None),
+                        images: str = "none", timings: bool = False, model: str = None,
+                        size: str = "full", format: str = "png", quality: int = None):
+    """
+    Score many images in one request: several `files`, or one zip `archive`.
+    Results stream back as NDJSON, one line per image in completion order
+    (each carries its `index` and `file` name), then a final summary line.
+    images=none (default) skips heatmap rendering; url or inline add the images
+    (size/format/quality as on /predict).
+    """
+    if error := check_model(model):
+        return {"error": error}
+    try:
+        render = render_options(size, format, quality)
+    except ValueError as e:
+        return {"error": str(e)}
+    if images not in ("none", "url", "inline"):
+        return {"error": "images must be none, url or inline."}
+
+    try:
+        items, zip_file = await open_batch_inputs(files, archive)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    # Copy every input before streaming starts; the uploads are closed after this handler returns
+    input_dir = await run_io(tempfile.mkdtemp, prefix="predict_batch_")
+    try:
+        copy_start = time.perf_counter()
+        paths = await asyncio.gather(*(copy_batch_input(source, zip_file, "predict_batch", input_dir)
+                                       for _, source in items))
+        copy_seconds = (time.perf_counter() - copy_start) / len(items)
+    except Exception as e:
+        await run_io(shutil.rmtree, input_dir, True)
+        return {"error": f"Could not read the uploaded files: {e}"}
+    finally:
+        if zip_file is not None:
+            zip_file.close()
+
+    inline = images == "inline"
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def score(index, name, path):
+        # The CPU pool decodes and standardizes files in parallel; their
+        # forward passes meet in the predictor's micro-batcher
+        async with slots:
+            timer = StageTimer({"upload_copy": copy_seconds})
+            try:
+                if images == "none":
+                    result = await run_predict_summary(path, model)
+                else:
+                    result = await run_predict(path, inline, model, render)
+                result = finish_result(result, timer, request, inline, timings)
+            except Exception as e:
+                result = {"error": str(e)}
+            finally:
+                await run_io(remove_file, path)
+        return {"index": index, "file": name, **result}
+
+    async def stream():
+        tasks = [asyncio.ensure_future(score(i, name, path)) for i, ((name, _), path) in enumerate(zip(items, paths))]
+        errors = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                line = await next_done
+                errors += "error" in line
+                yield json.dumps(line) + "\n"
+            yield json.dumps({"done": True, "count": len(items), "errors": errors}) + "\n"
+        finally:
+            # Client went away: stop scoring the rest
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await run_io(shutil.rmtree, input_dir, True)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/jobs", status_code=202)
+async def submit_job(files: List[UploadFile] = File(None), archive: UploadFile = File(None), model: str = None):
+    """
+    Queue many images (several `files` or one zip `archive`) for background
+    scoring. Returns the job's status; poll GET /jobs/{job_id} for progress
+    and fetch GET /jobs/{job_id}/result when it is done.
+    """
+    if error := check_model(model):
+        return JSONResponse({"error": error}, status_code=400)
+    if await run_io(job_store.count_pending) >= JOB_MAX_PENDING:
+        return JSONResponse({"error": "Job queue is full. Please try again later."}, status_code=503,
+                            headers={"Retry-After": str(int(JOB_POLL_S * 6))})
+    try:
+        items, zip_file = await open_batch_inputs(files, archive)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    # Inputs are copied into the job's own directory so the job survives a restart
+    job_id, input_dir = await run_io(job_store.new_job)
+    try:
+        paths = await asyncio.gather(*(copy_batch_input(source, zip_file, "jobs", input_dir) for _, source in items))
+        await run_io(job_store.submit, job_id, [(name, path) for (name, _), path in zip(items, paths)], model)
+    except Exception as e:
+        await run_io(job_store.discard, job_id)
+        return JSONResponse({"error": f"Could not queue job: {e}"}, status_code=500)
+    finally:
+        if zip_file is not None:
+            zip_file.close()
+
+    job_wakeup.set()
+    return await run_io(job_store.status, job_id)
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    status = await run_io(job_store.status, job_id)
+    if status is None:
+        return JSONResponse({"error": "Unknown job."}, status_code=404)
+    return status
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str):
+    """Per-file results; partial while the job is running."""
+    status = await run_io(job_store.status, job_id)
+    if status is None:
+        return JSONResponse({"error": "Unknown job."}, status_code=404)
+    status["results"] = await run_io(job_store.results, job_id)
+    return status
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Stop a queued or running job; files already scored keep their results."""
+    if await run_io(job_store.cancel, job_id) is None:
+        return JSONResponse({"error": "Unknown job."}, status_code=404)
+    return await run_io(job_store.status, job_id)
 
 @app.post("/preview")
 async def preview(file: UploadFile = File(...)):
-    suffix = file.filename.split('.')[-1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{suffix}") as tmp:
-        shutil.copyfileobj(file.file, tmp)
-        temp_path = tmp.name
+    timer = StageTimer()
+    data = None
+    if load_preview_array_from_bytes and numpy_to_base64:
+        with timer.stage("upload_read"):
+            data = await run_io(read_upload, file, "preview")
+    if data is not None:
+        record_timings(timer.timings)
+        try:
+            if run_prediction_from_array and preview_is_standardized(file.filename):
+                return await run_preview_session(data=data, filename=file.filename)
+            return {"preview_image": await run_preview_bytes(data, file.filename)}
+        except Exception as e:
+            return {"error": str(e)}
+
+    with timer.stage("upload_copy"):
+        temp_path = await run_io(save_upload_to_temp, file, "preview")
+    record_timings(timer.timings)
     try:
-        if generate_preview:
-            preview_img = generate_preview(temp_path)
+        if run_prediction_from_array and preview_is_standardized(temp_path):
+            result = await run_preview_session(temp_path)
+        elif generate_preview:
+            preview_img = await run_preview(temp_path)
             result = {"preview_image": preview_img}
         else:
             result = {"error": "Preview not available"}
     except Exception as e:
         result = {"error": str(e)}
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-    return result
\ No newline at end of file
+        await run_io(remove_file, temp_path)
+    return result
+
+@app.get("/images/{image_id}", name="get_image")
+async def get_image(image_id: str, request: Request, format: str = "png"):
+    """Serve a rendered image as raw bytes with HTTP caching headers."""
+    if format not in IMAGE_FORMATS:
+        return Response(status_code=400, content=f"Unsupported format: {format}")
+
+    item = image_store.get(image_id)
+    if item is None:
+        return Response(status_code=404)
+
+    etag = image_id if format == "png" else f"{image_id}.{format}"
+    headers = {"ETag": f'"{etag}"', "Cache-Control": IMAGE_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type, data = item
+    if format != "png":
+        variant = image_store.get(etag)
+        if variant is None:
+            data = await run_io(reencode_image, data, format)
+            image_store.put(data, IMAGE_FORMATS[format], image_id=etag)
+        else:
+            data = variant[1]
+        media_type = IMAGE_FORMATS[format]
+
+    return Response(content=data, media_type=media_type, headers=headers)
+
+@app.get("/models")
+async def models():
+    """Models accepted by ?model= on the predict endpoints; the first is the default."""
+    names = available_models() if available_models else []
+    return {"models": names, "default": names[0] if names else None}
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving HTTP."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the model is loaded and warmed up, 503 until then."""
+    if readiness["ready"]:
+        return {"status": "ready", "load_seconds": readiness["load_seconds"],
+                "library_cases_ready": len(library_store)}
+    if readiness["error"]:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": readiness["error"]})
+    return JSONResponse(status_code=503, content={"status": "loading"})
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of stage timings, cache counters and queue depths."""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,210 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import torch
+import timm
+
+from wsod_model import WSODModel
+from result_cache import file_sha256
+from inference_backends import INFERENCE_BACKEND, create_backend
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# Checkpoints served from one process: "name=path[:hflip],...". Every model is
+# loaded as a WSODModel around a timm ResNet50, so each one yields logits and a
+# layer4 attention map. `hflip` marks models trained on images read with
+# SimpleITK directly (predict_nodule's orientation), which is the mirror image
+# of the NODE21 orientation the shared pipeline produces.
+MODELS = os.getenv("MODELS", "wsod=best_wsod_resnet50.pth,baseline=resnet50-baseline-nodule.pth:hflip")
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "wsod")
+
+# Cleaned-up copy of each checkpoint (full state dict, weights only), memory-mapped
+# on later starts instead of unpickling and remapping the original. "" disables it.
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", os.path.join(os.getcwd(), "model_cache"))
+
+
+def parse_model_specs(text=MODELS):
+    """'name=path[:hflip],...' -> OrderedDict name -> {"path", "hflip"}."""
+    specs = OrderedDict()
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        path, _, options = value.strip().partition(":")
+        specs[name.strip()] = {"path": path, "hflip": "hflip" in options.split(":")}
+    return specs
+
+
+# ============================================================
+# ONE MODEL
+# ============================================================
+def build_model():
+    base_model = timm.create_model('resnet50', pretrained=False, num_classes=2)
+    return WSODModel(base_model, num_classes=2)
+
+
+def load_serialized_model(path):
+    """
+    Fast path: build the network on the meta device (no random init) and
+    memory-map the cached weights straight into it.
+    """
+    state_dict = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    with torch.device("meta"):
+        net = build_model()
+    net.load_state_dict(state_dict, assign=True)
+    return net
+
+
+def save_serialized_model(net, path):
+    """Write the full state dict atomically so concurrent starts never read half a file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            torch.save(net.state_dict(), f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class RegisteredModel:
+    """A checkpoint plus its lazily loaded classifier and inference backend."""
+
+    def __init__(self, name, path, hflip, device, calibration_data=None):
+        self.name = name
+        self.path = path
+        self.hflip = hflip
+        self.device = device
+        self.calibration_data = calibration_data
+        self._hash = None
+        self._net = None
+        self._backend = None
+        self._lock = threading.RLock()
+
+    def available(self):
+        return os.path.exists(self.path)
+
+    def model_hash(self):
+        """SHA-256 of the checkpoint; keys the result cache and the serialized model."""
+        if self._hash is None:
+            with self._lock:
+                if self._hash is None:
+                    if not self.available():
+                        raise FileNotFoundError(f"Model file not found: {self.path}")
+                    self._hash = file_sha256(self.path)
+        return self._hash
+
+    def cache_key(self):
+        """Identifies this model's outputs: optimized backends do not match eager bit for bit."""
+        if INFERENCE_BACKEND == "eager":
+            return self.model_hash()
+        return f"{self.model_hash()}-{INFERENCE_BACKEND}"
+
+    def cache_prefix(self):
+        """Path prefix for files derived from this checkpoint, or None if MODEL_CACHE_DIR is disabled."""
+        if not MODEL_CACHE_DIR:
+            return None
+        return os.path.join(MODEL_CACHE_DIR, f"resnet50-{self.model_hash()[:16]}")
+
+    def load_from_checkpoint(self):
+        """Original loading path: build the network, unpickle the checkpoint, strip DataParallel prefixes."""
+        net = build_model()
+        ckpt = torch.load(self.path, map_location="cpu", weights_only=False)
+        if isinstance(ckpt, dict):
+            state_dict = ckpt.get("model_state_dict", ckpt.get("state_dict", ckpt))
+        else:
+            state_dict = ckpt
+
+        new_state_dict = OrderedDict()
+        for k, v in state_dict.items():
+            new_key = k[len("module."):] if k.startswith("module.") else k
+            new_state_dict[new_key] = v
+
+        # Plain timm ResNet50 checkpoints (e.g. the baseline) go inside the WSOD wrapper
+        if not any(k.startswith("base_model.") for k in new_state_dict):
+            new_state_dict = OrderedDict((f"base_model.{k}", v) for k, v in new_state_dict.items())
+
+        net.load_state_dict(new_state_dict, strict=False)
+        return net
+
+    def classifier(self):
+        """Load the network once, preferring the serialized copy."""
+        if self._net is None:
+            with self._lock:
+                if self._net is None:
+                    print(f"Loading classification model '{self.name}'...")
+                    prefix = self.cache_prefix()
+                    cache_path = f"{prefix}.pt" if prefix else None
+                    net = None
+                    if cache_path and os.path.exists(cache_path):
+                        try:
+                            net = load_serialized_model(cache_path)
+                        except Exception as e:
+                            print(f"⚠️ Serialized model unusable, falling back to the checkpoint: {e}")
+                    if net is None:
+                        net = self.load_from_checkpoint()
+                        if cache_path:
+                            try:
+                                save_serialized_model(net, cache_path)
+                            except Exception as e:
+                                print(f"⚠️ Could not write serialized model: {e}")
+                    net = net.to(self.device)
+                    net.eval()
+                    self._net = net
+                    print("Model loaded successfully.")
+        return self._net
+
+    def build_backend(self, backend_name):
+        """Wrap the classifier in the named inference backend (see inference_backends.py)."""
+        return create_backend(backend_name, self.classifier(), self.device, self.cache_prefix(),
+                              self.calibration_data)
+
+    def backend(self):
+        """The INFERENCE_BACKEND used for serving; falls back to eager if it cannot be built."""
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    try:
+                        backend = self.build_backend(INFERENCE_BACKEND)
+                    except Exception as e:
+                        print(f"⚠️ Inference backend '{INFERENCE_BACKEND}' failed for '{self.name}', using eager: {e}")
+                        backend = self.build_backend("eager")
+                    print(f"Inference backend for '{self.name}': {backend.name}")
+                    self._backend = backend
+        return self._backend
+
+
+# ============================================================
+# REGISTRY
+# ============================================================
+class ModelRegistry:
+    """
+    All configured checkpoints in one process. Models share the torch
+    runtime, the preprocessing and (with MODEL_CACHE_DIR) memory-mapped
+    weights, instead of one server per model.
+    """
+
+    def __init__(self, device, specs=None, default=DEFAULT_MODEL, calibration_data=None):
+        specs = parse_model_specs() if specs is None else specs
+        self.models = OrderedDict(
+            (name, RegisteredModel(name, spec["path"], spec["hflip"], device, calibration_data))
+            for name, spec in specs.items()
+        )
+        if default not in self.models:
+            raise ValueError(f"DEFAULT_MODEL '{default}' is not in MODELS ({', '.join(self.models)})")
+        self.default = default
+
+    def get(self, name=None):
+        name = name or self.default
+        if name not in self.models:
+            raise KeyError(name)
+        return self.models[name]
+
+    def available(self):
+        """Names of models whose checkpoint is present (the default is always included)."""
+        return [name for name, m in self.models.items() if name == self.default or m.available()]
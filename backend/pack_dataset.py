@@ -0,0 +1,42 @@
+"""
+Pack a training/evaluation set into a memory-mapped cache for NoduleDataset.
+
+Decodes every .mha listed in a CSV once, min-max normalizes it to uint8 at
+the chosen resolution and writes <out>.npy (N x size x size) and <out>.json
+(name -> row index). Training then reads samples straight from the page
+cache instead of decoding full-resolution files every epoch.
+
+Example:
+    python pack_dataset.py --csv metadata.csv --images-dir images --out cache/node21-512 --size 512
+
+    # transform must take (3, H, W) uint8 tensors, e.g. ConvertImageDtype instead of ToTensor
+    dataset = NoduleDataset(df, "images", transform, cache_prefix="cache/node21-512")
+"""
+import sys
+import csv
+import time
+import argparse
+
+from DataHandler import pack_images
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode images once into a memory-mapped uint8 cache.")
+    parser.add_argument("--csv", required=True, help="CSV with an img_name column")
+    parser.add_argument("--images-dir", required=True)
+    parser.add_argument("--out", required=True, help="output prefix (writes <out>.npy and <out>.json)")
+    parser.add_argument("--size", type=int, default=512,
+                        help="side length in pixels; pick at least the training input size (default 512)")
+    parser.add_argument("--workers", type=int, default=None, help="decoding threads (default min(8, cores))")
+    args = parser.parse_args(argv)
+
+    with open(args.csv, newline="") as f:
+        names = [row["img_name"] for row in csv.DictReader(f)]
+    start = time.perf_counter()
+    array_path, _ = pack_images(names, args.images_dir, args.out, size=args.size, workers=args.workers)
+    print(f"✅ Packed {len(set(names))} images into {array_path} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,13 +3,12 @@ import io
 import base64
 import torch
 import timm
-import numpy as np
 from PIL import Image
 import SimpleITK as sitk
-from torchvision import transforms
 from collections import OrderedDict
 
 from wsod_model import WSODModel
+from preprocessing import normalize_to_uint8, to_model_tensor
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 # MODEL_PATH = "best_wsod_resnet50.pth"
@@ -46,8 +45,8 @@ print("Model loaded successfully.")
 # ============================================================
 # HELPER FUNCTION
 # ============================================================
-def mha_to_base64_png(image_path):
-    """Convert .mha image to base64-encoded PNG data URL for browser display."""
+def read_mha_uint8(image_path):
+    """Read an .mha image once and min-max normalize it to a uint8 array."""
     image = sitk.ReadImage(image_path)
     img_array = sitk.GetArrayFromImage(image)
     
@@ -56,54 +55,35 @@ def mha_to_base64_png(image_path):
         img_array = img_array[0]
     
     # Normalize to 0-255
-    img_array = img_array.astype(np.float32)
-    img_min, img_max = img_array.min(), img_array.max()
-    if img_max > img_min:
-        img_array = ((img_array - img_min) / (img_max - img_min) * 255).astype(np.uint8)
-    else:
-        img_array = np.zeros_like(img_array, dtype=np.uint8)
-    
-    # Convert to PIL Image and save as PNG to bytes
+    return normalize_to_uint8(img_array, zero_if_flat=True)
+
+
+def uint8_to_base64_png(img_array):
+    """Encode a uint8 grayscale array as a base64 PNG data URL."""
     pil_img = Image.fromarray(img_array, mode='L')
     buf = io.BytesIO()
     pil_img.save(buf, format='PNG')
-    buf.seek(0)
     
     # Encode to base64
     img_base64 = base64.b64encode(buf.getvalue()).decode('ascii')
     return f"data:image/png;base64,{img_base64}"
 
 
-def load_mha_image(image_path):
-    """Load and preprocess .mha image into a tensor."""
-    image = sitk.ReadImage(image_path)
-    img_array = sitk.GetArrayFromImage(image)
-
-    if len(img_array.shape) == 3:
-        img_array = img_array[0]
-
-    img_array = img_array.astype(np.float32)
-    img_min, img_max = img_array.min(), img_array.max()
-    if img_max > img_min:
-        img_array = ((img_array - img_min) / (img_max - img_min) * 255).astype(np.uint8)
-    else:
-        img_array = np.zeros_like(img_array, dtype=np.uint8)
+def mha_to_base64_png(image_path):
+    """Convert .mha image to base64-encoded PNG data URL for browser display."""
+    return uint8_to_base64_png(read_mha_uint8(image_path))
 
-    img_array = np.stack([img_array, img_array, img_array], axis=-1)
-    image = Image.fromarray(img_array)
 
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                             std=[0.229, 0.224, 0.225]),
-    ])
-    return transform(image).unsqueeze(0)
+def load_mha_image(image_path):
+    """Load and preprocess .mha image into a tensor."""
+    return to_model_tensor(read_mha_uint8(image_path))
 
 
 def predict_image(image_path):
     """Run model prediction and return class + confidence."""
-    img_tensor = load_mha_image(image_path).to(DEVICE)
+    # Decode and normalize once; reuse for both the model input and the preview
+    img_u8 = read_mha_uint8(image_path)
+    img_tensor = to_model_tensor(img_u8).to(DEVICE)
     with torch.no_grad():
         outputs = model(img_tensor)
         probs = torch.softmax(outputs, dim=1)
@@ -111,7 +91,7 @@ def predict_image(image_path):
         confidence = probs[0][pred_class].item()
     
     # Convert MHA to base64 PNG for browser display
-    preview_image = mha_to_base64_png(image_path)
+    preview_image = uint8_to_base64_png(img_u8)
     
     return {
         "prediction": CLASS_NAMES[pred_class],
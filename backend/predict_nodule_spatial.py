@@ -1,64 +1,194 @@
 import os
 import io
+import glob
+import functools
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import torch
-import torch.nn.functional as F
-import timm
 import numpy as np
 from PIL import Image
 import SimpleITK as sitk
-from torchvision import transforms
-from collections import OrderedDict
-import cv2
 
 # --- NEW IMPORTS FOR NODE21 PREPROCESSING ---
 import opencxr
 from opencxr.utils.file_io import read_file
 
-from wsod_model import WSODModel
+from model_registry import ModelRegistry
+from batch_inference import MicroBatcher, BATCH_MAX_SIZE
+from result_cache import ResultCache, file_sha256, bytes_sha256
+from ingest import (IMAGE_EXTENSIONS, DEFAULT_SPACING, NeedsFile, decode_upload,
+                    decode_standardized, spooled_file)
+from preprocessing import normalize_to_uint8, to_model_tensor
+from heatmap_render import RENDER_FORMATS, blend_heatmap, encode_image, render_images, resize_for_display
+from metrics import StageTimer, CACHE_EVENTS
+from tta import TTA_SHIFT, TTA_ZOOM, parse_views, augment, fuse, summarize as tta_summary
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-MODEL_PATH = "best_wsod_resnet50.pth"
 CLASS_NAMES = ["No Nodule", "Nodule Detected"]
 
+# Part of the predictor interface: main.py validates ?tta= with it via getattr
+parse_tta_views = parse_views
+
 # ============================================================
-# LOAD PREPROCESSING ALGORITHM (NODE21 STANDARD)
+# CONFIGURATION
 # ============================================================
-print("Loading NODE21 preprocessing algorithm (opencxr)...")
-try:
-    # Load the standardization algorithm once
-    cxr_std_algorithm = opencxr.load(opencxr.algorithms.cxr_standardize)
-    print("Preprocessing algorithm loaded.")
-except Exception as e:
-    print(f"Error loading opencxr: {e}")
-    print("Ensure you have installed opencxr: pip install opencxr")
-    raise e
+TESTCASES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testcases")
+
+# Bundled case run once after loading so the first real request is not the slow one
+WARMUP_IMAGE = os.getenv("WARMUP_IMAGE", os.path.join(TESTCASES_DIR, "withoutnodules", "n1069.mha"))
+
+# ?model=ensemble averages these models' probabilities (default: every available model)
+ENSEMBLE = "ensemble"
+ENSEMBLE_MODELS = [m.strip() for m in os.getenv("ENSEMBLE_MODELS", "").split(",") if m.strip()]
+
+# Multi-slice studies (predict_volume): slices per forward pass, which also bounds
+# how many standardized slices are in memory; threads standardizing slices
+VOLUME_CHUNK_SIZE = int(os.getenv("VOLUME_CHUNK_SIZE", str(BATCH_MAX_SIZE)))
+VOLUME_THREADS = int(os.getenv("VOLUME_THREADS", str(min(4, os.cpu_count() or 1))))
+VOLUME_MAX_SLICES = int(os.getenv("VOLUME_MAX_SLICES", "512"))
+VOLUME_EXTENSIONS = ['.mha', '.mhd', '.dcm', '.dicom']
 
 # ============================================================
-# LOAD MODEL
+# LAZY MODEL LOADING
 # ============================================================
-print("Loading classification model...")
-base_model = timm.create_model('resnet50', pretrained=False, num_classes=2)
-model = WSODModel(base_model, num_classes=2)
+# Nothing heavy happens at import time: the server can bind its port right away
+# and load in the background. Every code path below calls the loader it needs.
+cxr_std_algorithm = None
+_preprocessor_lock = threading.Lock()
+
+def load_preprocessor():
+    """Load the NODE21 standardization algorithm (opencxr) once."""
+    global cxr_std_algorithm
+    if cxr_std_algorithm is None:
+        with _preprocessor_lock:
+            if cxr_std_algorithm is None:
+                print("Loading NODE21 preprocessing algorithm (opencxr)...")
+                try:
+                    cxr_std_algorithm = opencxr.load(opencxr.algorithms.cxr_standardize)
+                    print("Preprocessing algorithm loaded.")
+                except Exception as e:
+                    print(f"Error loading opencxr: {e}")
+                    print("Ensure you have installed opencxr: pip install opencxr")
+                    raise e
+    return cxr_std_algorithm
+
+def calibration_tensors(limit):
+    """Model inputs from the bundled test cases, for int8 static calibration."""
+    paths = sorted(glob.glob(os.path.join(TESTCASES_DIR, "**", "*.mha"), recursive=True))
+    for path in paths[:limit]:
+        yield prepare_tensor_for_model(preprocess_node21_style(path))
 
-if not os.path.exists(MODEL_PATH):
-    raise FileNotFoundError(f"Model file not found: {MODEL_PATH}")
+# Every checkpoint in MODELS (see model_registry.py); each loads on first use
+registry = ModelRegistry(DEVICE, calibration_data=calibration_tensors)
 
-ckpt = torch.load(MODEL_PATH, map_location=DEVICE, weights_only=False)
-if isinstance(ckpt, dict):
-    state_dict = ckpt.get("model_state_dict", ckpt.get("state_dict", ckpt))
-else:
-    state_dict = ckpt
+def available_models():
+    """Model names accepted by ?model=, default first."""
+    names = registry.available()
+    names.sort(key=lambda name: name != registry.default)
+    return names + [ENSEMBLE] if len(names) > 1 else names
 
-new_state_dict = OrderedDict()
-for k, v in state_dict.items():
-    new_key = k[len("module."):] if k.startswith("module.") else k
-    new_state_dict[new_key] = v
+def ensemble_members():
+    return ENSEMBLE_MODELS or registry.available()
 
-model.load_state_dict(new_state_dict, strict=False)
-model = model.to(DEVICE)
-model.eval()
-print("Model loaded successfully.")
+def get_model_hash(model_name=None):
+    """Key for a model's outputs in the result cache (checkpoint hash + backend)."""
+    if model_name == ENSEMBLE:
+        return "ensemble:" + "+".join(registry.get(name).cache_key() for name in ensemble_members())
+    return registry.get(model_name).cache_key()
+
+def load_classifier(model_name=None):
+    """The loaded WSODModel for a registered model (the default if None)."""
+    return registry.get(model_name).classifier()
+
+def build_backend(name, model_name=None):
+    """Wrap a model in the named inference backend (see inference_backends.py)."""
+    return registry.get(model_name).build_backend(name)
+
+def load_backend(model_name=None):
+    return registry.get(model_name).backend()
+
+def load_models():
+    """Load opencxr and every available classifier, in parallel (both mostly release the GIL)."""
+    errors = []
+    
+    def load_in_background():
+        try:
+            load_preprocessor()
+        except Exception as e:
+            errors.append(e)
+    
+    thread = threading.Thread(target=load_in_background, name="load-opencxr")
+    thread.start()
+    for name in registry.available():
+        load_backend(name)
+    thread.join()
+    if errors:
+        raise errors[0]
+
+def warm_up(image_path=WARMUP_IMAGE):
+    """Load everything, then run one uncached inference on a bundled case."""
+    load_models()
+    if not image_path or not os.path.exists(image_path):
+        return
+    img_tensor = prepare_tensor_for_model(preprocess_node21_style(image_path))
+    for name in registry.available():
+        infer_batch(img_tensor, name)
+
+# ============================================================
+# RESULT CACHE (keyed by image content + model)
+# ============================================================
+# Each lookup passes its model's key (see get_model_hash)
+result_cache = ResultCache()
+
+# ============================================================
+# BATCHED INFERENCE
+# ============================================================
+def infer_batch(batch_tensor, model_name=None):
+    """
+    Run classification and attention extraction on a (N, 3, 224, 224) batch.
+    Returns logits (N, num_classes) and raw attention maps (N, h, w) on the CPU.
+    """
+    entry = registry.get(model_name)
+    backend = entry.backend()
+    with torch.no_grad():
+        if entry.hflip:
+            batch_tensor = torch.flip(batch_tensor, dims=[3])
+        # One backbone pass yields both the logits and the layer4 attention
+        outputs, attention = backend(batch_tensor)
+        if entry.hflip:
+            attention = torch.flip(attention, dims=[3])  # back to the displayed orientation
+        # Same scaling as WSODModel.get_attention_map, but per sample
+        attention = attention - attention.amin(dim=(1, 2, 3), keepdim=True)
+        attention = attention / (attention.amax(dim=(1, 2, 3), keepdim=True) + 1e-8)
+    return outputs.cpu(), attention[:, 0].cpu()
+
+# Concurrent predict_image calls share forward passes through one scheduler per model
+batchers = {name: MicroBatcher(functools.partial(infer_batch, model_name=name)) for name in registry.models}
+batcher = batchers[registry.default]
+
+def queue_depth():
+    return sum(b.queue_depth() for b in batchers.values())
+
+def infer_models(img_tensor, model_name=None):
+    """
+    Logits (N, C) and attention (N, h, w) for N images from a single model,
+    or for ?model=ensemble from every member on the same tensor.
+    Also returns the members' logits (M, N, C), or None for a single model.
+    """
+    if model_name != ENSEMBLE:
+        outputs, attention = batchers[model_name or registry.default].infer(img_tensor)
+        return outputs, attention, None
+    
+    # Submit to every member first so their forward passes run concurrently
+    members = ensemble_members()
+    futures = [batchers[name].submit(img_tensor) for name in members]
+    results = [future.result() for future in futures]
+    member_logits = torch.stack([outputs for outputs, _ in results])
+    # Average probabilities; log() keeps the softmax-based helpers working
+    probs = torch.softmax(member_logits, dim=2).mean(dim=0)
+    attention = torch.stack([att for _, att in results]).mean(dim=0)
+    return torch.log(probs), attention, member_logits
 
 # ============================================================
 # HELPER FUNCTIONS
@@ -76,159 +206,139 @@ def preprocess_node21_style(image_path):
     """
     file_extension = os.path.splitext(image_path)[1].lower()
     
-    if file_extension in ['.mha', '.mhd']:
-        # Already preprocessed - use opencxr to read
+    if file_extension in ['.mha', '.mhd', '.dcm', '.dicom']:
+        # opencxr reads both (x, y layout plus spacing)
         img_np, spacing, _ = read_file(image_path)
-        std_img = img_np
-        std_img = np.rot90(std_img, k=-1)
-        
-    elif file_extension in ['.dcm', '.dicom']:
-        # DICOM files - opencxr can handle these
-        img_np, spacing, _ = read_file(image_path)
-        std_img, new_spacing, size_changes = cxr_std_algorithm.run(img_np, spacing)
-        
-    elif file_extension in ['.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff']:
+    elif file_extension in IMAGE_EXTENSIONS:
         # Image files - read with PIL, then preprocess
-        img_pil = Image.open(image_path).convert('L')
-        img_np = np.array(img_pil)
-        spacing = (0.143, 0.143)
-        
-        try:
-            std_img, new_spacing, size_changes = cxr_std_algorithm.run(img_np, spacing)
-        except Exception as preproc_error:
-            # Fallback: simple resize
-            img_pil_resized = img_pil.resize((1024, 1024), Image.Resampling.LANCZOS)
-            std_img = np.array(img_pil_resized)
+        img_np = np.array(Image.open(image_path).convert('L'))
+        spacing = DEFAULT_SPACING
     else:
         raise ValueError(f"Unsupported file format: {file_extension}. "
                        f"Supported formats: .mha, .mhd, .dcm, .jpg, .jpeg, .png, .bmp, .tif, .tiff")
     
+    return standardize_image(img_np, spacing, file_extension)
+
+def standardize_image(img_np, spacing, file_extension):
+    """
+    NODE21 standardization of an already-decoded image (opencxr layout for
+    medical formats, PIL grayscale for regular images).
+    """
+    if file_extension in ['.mha', '.mhd']:
+        # Already preprocessed - only fix the orientation
+        return np.rot90(img_np, k=-1)
+    
+    if file_extension in ['.dcm', '.dicom']:
+        std_img, new_spacing, size_changes = load_preprocessor().run(img_np, spacing)
+        return std_img
+    
+    try:
+        std_img, new_spacing, size_changes = load_preprocessor().run(img_np, spacing)
+    except Exception as preproc_error:
+        # Fallback: simple resize
+        img_pil_resized = Image.fromarray(img_np).resize((1024, 1024), Image.Resampling.LANCZOS)
+        std_img = np.array(img_pil_resized)
     return std_img
 
+def preprocess_upload(data, filename):
+    """
+    preprocess_node21_style for upload bytes: decoded in memory where
+    ingest.py can, otherwise through a temp file.
+    """
+    try:
+        img_np, spacing = decode_upload(data, filename)
+    except NeedsFile:
+        with spooled_file(data, filename) as path:
+            return preprocess_node21_style(path)
+    return standardize_image(img_np, spacing, os.path.splitext(filename)[1].lower())
+
+def preview_is_standardized(image_path):
+    """True if load_preview_array returns the same array predict_image would classify."""
+    return os.path.splitext(image_path)[1].lower() in ['.mha', '.mhd', '.dcm', '.dicom']
+
+def load_preview_array(image_path):
+    """
+    Load the array shown as the upload preview.
+    Medical formats are standardized; regular images are shown as-is.
+    """
+    if preview_is_standardized(image_path):
+        _, cached = lookup_cached_result(image_path)
+        if cached is not None:
+            return cached["std_img"]
+        return preprocess_node21_style(image_path)
+    
+    img_pil = Image.open(image_path).convert('L')
+    return np.array(img_pil)
+
+def load_preview_array_from_bytes(data, filename):
+    """load_preview_array for upload bytes, without writing them to disk first."""
+    if preview_is_standardized(filename):
+        _, cached = lookup_cached_content(bytes_sha256(data))
+        if cached is not None:
+            return cached["std_img"]
+        return preprocess_upload(data, filename)
+    
+    with Image.open(io.BytesIO(data)) as img_pil:
+        return np.array(img_pil.convert('L'))
+
 def generate_preview(image_path):
     """
     Generate a preview image for any supported file type.
     This is called when a file is uploaded, before classification.
     """
     try:
-        file_extension = os.path.splitext(image_path)[1].lower()
-        
-        if file_extension in ['.mha', '.mhd', '.dcm', '.dicom']:
-            # For medical imaging formats, preprocess and return as base64
-            std_img_np = preprocess_node21_style(image_path)
-            return numpy_to_base64(std_img_np)
-        else:
-            # For regular images (jpg, png, etc), just read and convert
-            img_pil = Image.open(image_path).convert('L')
-            img_np = np.array(img_pil)
-            return numpy_to_base64(img_np)
+        return numpy_to_base64(load_preview_array(image_path))
     except Exception as e:
         print(f"Preview generation failed: {str(e)}")
         return None
 
+def png_to_data_url(png_bytes, media_type="image/png"):
+    """Wrap PNG (or other encoded image) bytes as a base64 data URL for the browser."""
+    img_base64 = base64.b64encode(png_bytes).decode('ascii')
+    return f"data:{media_type};base64,{img_base64}"
+
+def encode_png(img_u8):
+    """Encode an already-normalized uint8 image (grayscale or RGB) as PNG bytes."""
+    buf = io.BytesIO()
+    Image.fromarray(img_u8).save(buf, format='PNG')
+    return buf.getvalue()
+
+def numpy_to_png(img_np):
+    """Convert numpy array (standardized image) to PNG bytes."""
+    return encode_png(normalize_to_uint8(img_np))
+
 def numpy_to_base64(img_np):
     """Convert numpy array (standardized image) to base64 PNG."""
-    # Ensure image is in 0-255 uint8 format
-    img_array = img_np.astype(np.float32)
-    img_min, img_max = img_array.min(), img_array.max()
-    
-    if img_max > img_min:
-        img_array = ((img_array - img_min) / (img_max - img_min) * 255).astype(np.uint8)
-    else:
-        img_array = img_array.astype(np.uint8)
-        
-    pil_img = Image.fromarray(img_array, mode='L')
-    
-    buf = io.BytesIO()
-    pil_img.save(buf, format='PNG')
-    buf.seek(0)
-    
-    img_base64 = base64.b64encode(buf.getvalue()).decode('ascii')
-    return f"data:image/png;base64,{img_base64}"
+    return png_to_data_url(numpy_to_png(img_np))
 
 def prepare_tensor_for_model(std_img_np):
     """
     Convert the standardized numpy image to a tensor compatible with ResNet50.
     """
-    # Ensure uint8 for PIL
-    img_array = std_img_np.astype(np.float32)
-    img_min, img_max = img_array.min(), img_array.max()
-    if img_max > img_min:
-        img_array = ((img_array - img_min) / (img_max - img_min) * 255).astype(np.uint8)
-    else:
-        img_array = img_array.astype(np.uint8)
-
-    # Convert to RGB (ResNet expects 3 channels)
-    # Even though it's grayscale, we replicate channels
-    img_pil = Image.fromarray(img_array).convert('RGB')
-
-    # Standard ImageNet transforms required by the model
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),  # Resize the 1024x1024 crop to model input
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406],
-                             std=[0.229, 0.224, 0.225]),
-    ])
-    
-    return transform(img_pil).unsqueeze(0)
+    return to_model_tensor(normalize_to_uint8(std_img_np))
+
+def heatmap_overlay_png(img_u8, attention_map):
+    """
+    Blend the attention heatmap over an already-normalized uint8 image and encode as PNG.
+    The JET colormap and the 60/40 blend come from one precomputed lookup table
+    (see heatmap_render.py), with the same pixels as applyColorMap + addWeighted.
+    """
+    return encode_png(blend_heatmap(img_u8, attention_map))
+
+def generate_heatmap_png(img_np, attention_map):
+    """
+    Generate heatmap overlay PNG bytes using the standardized image data directly.
+    """
+    return heatmap_overlay_png(normalize_to_uint8(img_np), attention_map)
 
 def generate_heatmap_overlay_from_data(img_np, attention_map):
     """
-    Generate heatmap overlay using the standardized image data directly.
+    Generate heatmap overlay (base64 PNG) using the standardized image data directly.
     """
-    # Normalize image to 0-255 uint8
-    img_array = img_np.astype(np.float32)
-    img_min, img_max = img_array.min(), img_array.max()
-    if img_max > img_min:
-        img_array = ((img_array - img_min) / (img_max - img_min) * 255).astype(np.uint8)
-    else:
-        img_array = img_array.astype(np.uint8)
-        
-    # Convert grayscale to RGB for overlay
-    img_rgb = cv2.cvtColor(img_array, cv2.COLOR_GRAY2RGB)
-    
-    # Get dimensions of the preprocessed image
-    original_height, original_width = img_rgb.shape[:2]
-    
-    # Resize attention map to match the preprocessed image size
-    attention_resized = cv2.resize(attention_map, (original_width, original_height), 
-                                   interpolation=cv2.INTER_LINEAR)
-    
-    # Normalize attention to 0-255
-    attention_norm = (attention_resized * 255).astype(np.uint8)
-    
-    # Apply colormap
-    heatmap = cv2.applyColorMap(attention_norm, cv2.COLORMAP_JET)
-    heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB)
-    
-    # Blend
-    overlay = cv2.addWeighted(img_rgb, 0.6, heatmap, 0.4, 0)
-    
-    # Convert to base64
-    pil_img = Image.fromarray(overlay)
-    buf = io.BytesIO()
-    pil_img.save(buf, format='PNG')
-    buf.seek(0)
-    img_base64 = base64.b64encode(buf.getvalue()).decode('ascii')
-    
-    return f"data:image/png;base64,{img_base64}"
-
-def get_attention_from_model(model, img_tensor):
-    """Extract attention map from WSODModel."""
-    if not hasattr(model, 'get_attention_map'):
-        # Fallback: use feature maps from layer4
-        features = img_tensor
-        for name, module in model.base_model.named_children():
-            features = module(features)
-            if name == 'layer4':
-                attention = features.mean(dim=1, keepdim=True)
-                attention = F.relu(attention)
-                break
-    else:
-        attention = model.get_attention_map(img_tensor)
-    
-    attention_np = attention.detach().cpu().squeeze().numpy()
-    
+    return png_to_data_url(generate_heatmap_png(img_np, attention_map))
+
+def normalize_attention_map(attention_np):
+    """Min-max scale a single attention map to [0, 1]."""
     att_min, att_max = attention_np.min(), attention_np.max()
     if att_max > att_min:
         attention_np = (attention_np - att_min) / (att_max - att_min)
@@ -237,43 +347,468 @@ def get_attention_from_model(model, img_tensor):
     
     return attention_np
 
-def predict_image(image_path):
-    """Run model prediction with NODE21 preprocessing."""
+def lookup_cached_content(content_hash, model_name=None):
+    """Return (cache_key, cached entry or None). Cache errors never fail a request."""
+    try:
+        cache_key = result_cache.key_for_content(content_hash, get_model_hash(model_name))
+        cached = result_cache.get(cache_key)
+        if result_cache.enabled:
+            CACHE_EVENTS.inc(cache="result", result="miss" if cached is None else "hit")
+        return cache_key, cached
+    except Exception as e:
+        print(f"⚠️ Result cache lookup failed: {e}")
+        return None, None
+
+def lookup_cached_result(image_path, model_name=None, tta=None):
+    """Same as lookup_cached_content, hashing the file at image_path."""
+    try:
+        content_hash = file_sha256(image_path)
+    except Exception as e:
+        print(f"⚠️ Result cache lookup failed: {e}")
+        return None, None
+    return lookup_cached_content(content_hash + tta_cache_suffix(tta), model_name)
+
+def tta_cache_suffix(tta):
+    """TTA results are cached apart from plain ones, per view set and view settings."""
+    return f"-tta:{','.join(tta)}:{TTA_SHIFT}:{TTA_ZOOM}" if tta else ""
+
+def logits_to_prediction(logits):
+    """Return (pred_class, confidence) for a single (1, num_classes) logits tensor."""
+    probs = torch.softmax(logits, dim=1)
+    pred_class = torch.argmax(probs, dim=1).item()
+    confidence = probs[0][pred_class].item()
+    return pred_class, confidence
+
+def raw_from_cache(cache_key, cached, timer, model_name=None):
+    """Rebuild run_prediction's output from a cache entry."""
+    pred_class, confidence = logits_to_prediction(torch.from_numpy(cached["logits"]))
+    return {
+        "model": model_name or registry.default,
+        "member_logits": cached.get("member_logits"),
+        "timings": timer.timings,
+        "std_img": cached["std_img"],
+        "logits": cached["logits"],
+        "pred_class": pred_class,
+        "confidence": confidence,
+        "attention_map": cached["attention"],
+        # Entries written by a non-default render hold no PNGs
+        **({"preview_png": cached["preview_png"].tobytes(), "heatmap_png": cached["heatmap_png"].tobytes()}
+           if "preview_png" in cached else {}),
+        **({"tta_views": [str(v) for v in cached["tta_views"]], "tta_probs": cached["tta_probs"]}
+           if "tta_probs" in cached else {}),
+        "cache_key": cache_key,
+        "cached": True,
+    }
+
+def run_prediction(image_path, model_name=None, tta=None):
+    """
+    Preprocessing + inference stages of predict_image (the CPU-heavy part).
+    `model_name` picks a registered model or ENSEMBLE (default model if None).
+    `tta` is a list of test-time augmentation views (see tta.py), or None.
+    Returns the raw outputs, or a dict with "error" if a stage failed.
+    """
+    return run_inference(run_preprocessing(image_path, model_name, tta), model_name, tta)
+
+def run_inference(staged, model_name=None, tta=None):
+    """
+    Inference stages for the output of run_preprocessing(_from_bytes).
+    Cache hits and errors pass through unchanged.
+    """
+    if "error" in staged or "pred_class" in staged:
+        return staged
+    return infer_standardized(staged["std_img"], staged["cache_key"], StageTimer(staged["timings"]),
+                              model_name, tta)
+
+def run_preprocessing(image_path, model_name=None, tta=None):
+    """
+    Cache lookup + preprocessing stages of run_prediction, so a caller can
+    show the standardized image before inference. Returns the raw outputs
+    on a cache hit, otherwise {"std_img", "cache_key", "timings"}.
+    """
+    timer = StageTimer()
+    
+    # 0. CACHE LOOKUP (a hit skips opencxr and the model entirely)
+    with timer.stage("cache_lookup"):
+        cache_key, cached = lookup_cached_result(image_path, model_name, tta)
+    if cached is not None:
+        return raw_from_cache(cache_key, cached, timer, model_name)
     
     # 1. PREPROCESSING (Domain Shift Fix)
     try:
-        std_img_np = preprocess_node21_style(image_path)
+        with timer.stage("preprocess"):
+            std_img_np = preprocess_node21_style(image_path)
+    except Exception as e:
+        return {"error": f"Preprocessing failed: {str(e)}"}
+
+    return {"std_img": std_img_np, "cache_key": cache_key, "timings": timer.timings}
+
+def run_prediction_from_bytes(data, filename, model_name=None, standardized=False, tta=None):
+    """
+    run_prediction for upload bytes, decoded in memory (see ingest.py).
+    With `standardized`, the upload is taken as an already-standardized
+    uint8 image (e.g. the /preview image) and only classified.
+    """
+    staged = run_preprocessing_from_bytes(data, filename, model_name, standardized, tta)
+    return run_inference(staged, model_name, tta)
+
+def run_preprocessing_from_bytes(data, filename, model_name=None, standardized=False, tta=None):
+    """run_preprocessing for upload bytes (see run_prediction_from_bytes)."""
+    timer = StageTimer()
+    # The same PNG bytes standardize differently than they classify as-is
+    content_hash = bytes_sha256(data) + ("-standardized" if standardized else "") + tta_cache_suffix(tta)
+    
+    with timer.stage("cache_lookup"):
+        cache_key, cached = lookup_cached_content(content_hash, model_name)
+    if cached is not None:
+        return raw_from_cache(cache_key, cached, timer, model_name)
+    
+    try:
+        with timer.stage("preprocess"):
+            if standardized:
+                std_img_np = decode_standardized(data, filename)
+            else:
+                std_img_np = preprocess_upload(data, filename)
     except Exception as e:
         return {"error": f"Preprocessing failed: {str(e)}"}
+    
+    return {"std_img": std_img_np, "cache_key": cache_key, "timings": timer.timings}
 
-    # 2. PREPARE TENSOR
+def run_prediction_from_array(std_img_np, content_hash=None, model_name=None, tta=None):
+    """
+    Same as run_prediction for an image that is already standardized,
+    e.g. one kept from /preview. `content_hash` enables the result cache.
+    """
+    timer = StageTimer()
+    cache_key = None
+    if content_hash:
+        with timer.stage("cache_lookup"):
+            cache_key, cached = lookup_cached_content(content_hash + tta_cache_suffix(tta), model_name)
+        if cached is not None:
+            return raw_from_cache(cache_key, cached, timer, model_name)
+    
+    return infer_standardized(std_img_np, cache_key, timer, model_name, tta)
+
+def infer_tta(img_tensor, views, model_name=None):
+    """
+    infer_models for every TTA view of one image in a single batched pass.
+    Returns the mean-probability logits (1, C), the attention maps aligned
+    back to the original view and averaged (1, h, w), the members' logits
+    averaged over views (M, 1, C) or None, and the per-view probabilities (V, C).
+    """
+    view_logits, view_attention, view_members = infer_models(augment(img_tensor, views), model_name)
+    outputs, attention, view_probs = fuse(view_logits, view_attention, views)
+    if view_members is not None:
+        view_members = torch.log(torch.softmax(view_members, dim=2).mean(dim=1, keepdim=True))
+    return outputs, attention[None], view_members, view_probs
+
+def infer_standardized(std_img_np, cache_key=None, timer=None, model_name=None, tta=None):
+    """Tensor preparation + inference stages for a standardized image (optionally with TTA views)."""
+    timer = timer or StageTimer()
+    
+    # 2. PREPARE TENSOR (normalize once; the uint8 copy is reused for rendering)
     try:
-        img_tensor = prepare_tensor_for_model(std_img_np).to(DEVICE)
+        with timer.stage("prepare_tensor"):
+            std_img_u8 = normalize_to_uint8(std_img_np)
+            img_tensor = to_model_tensor(std_img_u8)
     except Exception as e:
         return {"error": f"Tensor preparation failed: {str(e)}"}
     
-    # 3. INFERENCE
+    # 3. INFERENCE (batched with any concurrent requests)
     try:
-        with torch.no_grad():
-            outputs = model(img_tensor)
-            probs = torch.softmax(outputs, dim=1)
-            pred_class = torch.argmax(probs, dim=1).item()
-            confidence = probs[0][pred_class].item()
-            attention_map = get_attention_from_model(model, img_tensor)
+        with timer.stage("inference"):
+            if tta:
+                outputs, attention, member_logits, view_probs = infer_tta(img_tensor, tta, model_name)
+            else:
+                outputs, attention, member_logits = infer_models(img_tensor, model_name)
+            pred_class, confidence = logits_to_prediction(outputs)
+        with timer.stage("attention"):
+            attention_map = normalize_attention_map(attention[0].numpy())
     except Exception as e:
         return {"error": f"Model inference failed: {str(e)}"}
     
-    # 4. VISUALIZATION
+    return {
+        "timings": timer.timings,
+        "model": model_name or registry.default,
+        "member_logits": None if member_logits is None else member_logits[:, 0].numpy(),
+        "std_img": std_img_np,
+        "std_img_u8": std_img_u8,
+        "logits": outputs.numpy(),
+        "pred_class": pred_class,
+        "confidence": confidence,
+        "attention_map": attention_map,
+        "cache_key": cache_key,
+        **({"tta_views": tta, "tta_probs": view_probs.numpy()} if tta else {}),
+    }
+
+def prediction_summary(raw):
+    """The prediction fields of render_prediction's output, without any images."""
+    if "error" in raw:
+        return raw
+    result = {
+        "prediction": CLASS_NAMES[raw["pred_class"]],
+        "confidence": round(raw["confidence"], 4),
+        "model": raw.get("model", registry.default),
+        "timings": raw.get("timings", {}),
+    }
+    if raw.get("member_logits") is not None:
+        # Ensemble: each member's own call, in ensemble_members() order
+        result["members"] = {}
+        for name, logits in zip(ensemble_members(), raw["member_logits"]):
+            pred_class, confidence = logits_to_prediction(torch.from_numpy(logits[None]))
+            result["members"][name] = {"prediction": CLASS_NAMES[pred_class], "confidence": round(confidence, 4)}
+    if "slices" in raw:
+        # Whole-volume study (run_volume_prediction): the images show key_slice
+        result.update(num_slices=len(raw["slices"]), key_slice=raw["key_slice"], slices=raw["slices"])
+    if raw.get("tta_probs") is not None:
+        # Test-time augmentation: the prediction is the views' mean, this is their spread
+        result["tta"] = tta_summary(raw["tta_probs"], raw["tta_views"])
+    return result
+
+def store_prediction(raw, timer, preview_png, heatmap_png, default_render=True):
+    """Write a fresh result to the cache (with its PNGs for the default rendering)."""
+    if not raw.get("cache_key") or "preview_png" in raw or (raw.get("cached") and not default_render):
+        return
+    try:
+        with timer.stage("cache_write"):
+            extra = {} if raw.get("member_logits") is None else {"member_logits": raw["member_logits"]}
+            if raw.get("tta_probs") is not None:
+                extra.update(tta_views=np.array(raw["tta_views"]), tta_probs=raw["tta_probs"])
+            if default_render:
+                extra.update(preview_png=preview_png, heatmap_png=heatmap_png)
+            result_cache.put(
+                raw["cache_key"],
+                std_img=raw["std_img"],
+                logits=raw["logits"],
+                attention=raw["attention_map"],
+                **extra,
+            )
+    except Exception as e:
+        print(f"⚠️ Result cache write failed: {e}")
+
+def render_preview(raw, size="full", image_format="png", quality=None):
+    """
+    Only the preview image of render_prediction, as encoded bytes. Works on
+    run_preprocessing's output too, so it can be sent before inference ends.
+    """
+    if size == "full" and image_format == "png" and quality is None:
+        if "preview_png" in raw:
+            return raw["preview_png"]
+        return encode_png(raw["std_img_u8"] if "std_img_u8" in raw else normalize_to_uint8(raw["std_img"]))
+    img_u8 = raw["std_img_u8"] if "std_img_u8" in raw else normalize_to_uint8(raw["std_img"])
+    return encode_image(resize_for_display(img_u8, size), image_format, quality)
+
+def render_heatmap(raw, size="full", image_format="png", quality=None):
+    """
+    The heatmap half of render_prediction, for a preview already sent with
+    render_preview. Returns render_prediction's heatmap fields, with the
+    image as bytes; store_prediction writes the cache entry afterwards.
+    """
+    if "error" in raw:
+        return raw
+    timer = StageTimer(raw.get("timings"))
+    default_render = size == "full" and image_format == "png" and quality is None
+    try:
+        with timer.stage("encode"):
+            if default_render and "heatmap_png" in raw:
+                heatmap_png = raw["heatmap_png"]
+            else:
+                img_u8 = raw["std_img_u8"] if "std_img_u8" in raw else normalize_to_uint8(raw["std_img"])
+                if default_render:
+                    heatmap_png = heatmap_overlay_png(img_u8, raw["attention_map"])
+                else:
+                    small = resize_for_display(img_u8, size)
+                    heatmap_png = encode_image(blend_heatmap(small, raw["attention_map"]), image_format, quality)
+    except Exception as e:
+        return {"error": f"Visualization failed: {str(e)}"}
+    result = {"preview_image": heatmap_png, "has_heatmap": True}
+    if image_format != "png":
+        result["image_type"] = RENDER_FORMATS[image_format]
+    result["timings"] = timer.timings
+    return result
+
+def render_prediction(raw, inline_images=True, size="full", image_format="png", quality=None):
+    """
+    Visualization stage of predict_image: PNG-encode the preview and heatmap.
+    With inline_images=False the images are returned as raw PNG bytes
+    instead of base64 data URLs (for serving them from /images).
+    `size` (thumbnail/screen/full), `image_format` (png/jpeg/webp) and
+    `quality` pick a smaller rendering; see heatmap_render.py.
+    """
+    if "error" in raw:
+        return raw
+    timer = StageTimer(raw.get("timings"))
+    
+    # 4. VISUALIZATION (the default full-size PNGs are already rendered on a cache hit)
+    default_render = size == "full" and image_format == "png" and quality is None
+    cache_hit = "preview_png" in raw
     try:
-        preview_image = numpy_to_base64(std_img_np)
-        heatmap_image = generate_heatmap_overlay_from_data(std_img_np, attention_map)
+        with timer.stage("encode"):
+            if default_render and cache_hit:
+                preview_png, heatmap_png = raw["preview_png"], raw["heatmap_png"]
+            else:
+                img_u8 = raw["std_img_u8"] if "std_img_u8" in raw else normalize_to_uint8(raw["std_img"])
+                if default_render:
+                    preview_png = encode_png(img_u8)
+                    heatmap_png = heatmap_overlay_png(img_u8, raw["attention_map"])
+                else:
+                    preview_png, heatmap_png = render_images(img_u8, raw["attention_map"], size,
+                                                             image_format, quality)
     except Exception as e:
         return {"error": f"Visualization failed: {str(e)}"}
     
+    # 5. STORE IN CACHE (custom renderings are not cached, only the inference outputs)
+    store_prediction(raw, timer, preview_png, heatmap_png, default_render)
+    
+    media_type = RENDER_FORMATS[image_format]
+    if inline_images:
+        with timer.stage("encode"):
+            heatmap_png = png_to_data_url(heatmap_png, media_type)
+            preview_png = png_to_data_url(preview_png, media_type)
+    
+    summary = prediction_summary(raw)
+    result = {
+        "prediction": summary.pop("prediction"),
+        "confidence": summary.pop("confidence"),
+        "preview_image": heatmap_png, 
+        "original_image": preview_png,
+        "has_heatmap": True,
+    }
+    result.update(summary)
+    if image_format != "png":
+        result["image_type"] = media_type
+    # Per-stage seconds; the server records these and strips them unless asked
+    result["timings"] = timer.timings
+    return result
+
+# ============================================================
+# MULTI-SLICE STUDIES
+# ============================================================
+def read_volume(image_path):
+    """
+    Slices of an .mha/.mhd/DICOM file as 2D arrays in opencxr's (x, y) layout
+    (what read_file returns for a single-slice file), plus the in-plane spacing.
+    """
+    # Check the header first so oversized or unsupported studies are refused
+    # before any pixel data is decoded
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(image_path)
+    reader.ReadImageInformation()
+    if reader.GetNumberOfComponents() > 1:
+        raise ValueError("Multi-channel (color) images are not supported")
+    size = reader.GetSize()  # (x, y) or (x, y, z)
+    if len(size) not in (2, 3):
+        raise ValueError(f"Expected a 2D image or 3D volume, got {len(size)} dimensions")
+    if len(size) == 3 and size[2] > VOLUME_MAX_SLICES:
+        raise ValueError(f"Volume has {size[2]} slices; the limit is {VOLUME_MAX_SLICES}")
+
+    itk_img = reader.Execute()
+    volume = sitk.GetArrayFromImage(itk_img)  # (z, y, x) or (y, x)
+    if volume.ndim == 2:
+        volume = volume[None]
+    return volume, tuple(itk_img.GetSpacing()[:2])
+
+def standardize_slice(volume, index, spacing, file_extension):
+    """One slice through the same standardization preprocess_node21_style applies to a file."""
+    return standardize_image(volume[index].T, spacing, file_extension)
+
+def run_volume_prediction(image_path, model_name=None):
+    """
+    Score every slice of a multi-slice study. Slices are standardized in
+    parallel and classified VOLUME_CHUNK_SIZE at a time (one forward pass
+    per chunk), so only one chunk of standardized slices is held in memory.
+
+    The study is positive if any slice is: its confidence comes from the
+    slice with the highest nodule probability (key_slice), whose image and
+    attention map are what render_prediction draws. Returns the same raw
+    form as run_prediction plus "slices" and "key_slice".
+    """
+    timer = StageTimer()
+    file_extension = os.path.splitext(image_path)[1].lower()
+    if file_extension not in VOLUME_EXTENSIONS:
+        # Regular images have a single frame
+        try:
+            with timer.stage("preprocess"):
+                std_img_np = preprocess_node21_style(image_path)
+        except Exception as e:
+            return {"error": f"Preprocessing failed: {str(e)}"}
+        volume, spacing, slice_count = None, None, 1
+    else:
+        try:
+            with timer.stage("read"):
+                volume, spacing = read_volume(image_path)
+        except Exception as e:
+            return {"error": f"Preprocessing failed: {str(e)}"}
+        slice_count = volume.shape[0]
+
+    def load_slice(index):
+        if volume is None:
+            return std_img_np
+        return standardize_slice(volume, index, spacing, file_extension)
+
+    slice_logits = []
+    key = None  # (nodule probability, index, std_img, std_img_u8, attention_map, member logits)
+    chunks = [list(range(start, min(start + VOLUME_CHUNK_SIZE, slice_count)))
+              for start in range(0, slice_count, VOLUME_CHUNK_SIZE)]
+    with ThreadPoolExecutor(max_workers=max(1, VOLUME_THREADS), thread_name_prefix="volume") as pool:
+        # Standardize the next chunk while the current one is in the model
+        pending = [pool.submit(load_slice, i) for i in chunks[0]]
+        for n, chunk in enumerate(chunks):
+            try:
+                with timer.stage("preprocess"):
+                    std_imgs = [future.result() for future in pending]
+            except Exception as e:
+                return {"error": f"Preprocessing failed: {str(e)}"}
+            pending = [pool.submit(load_slice, i) for i in chunks[n + 1]] if n + 1 < len(chunks) else []
+
+            try:
+                with timer.stage("prepare_tensor"):
+                    std_u8s = [normalize_to_uint8(img) for img in std_imgs]
+                    batch_tensor = torch.cat([to_model_tensor(img) for img in std_u8s])
+                with timer.stage("inference"):
+                    outputs, attention, members = infer_models(batch_tensor, model_name)
+            except Exception as e:
+                return {"error": f"Model inference failed: {str(e)}"}
+
+            slice_logits.append(outputs)
+            nodule_probs = torch.softmax(outputs, dim=1)[:, 1]
+            best = int(torch.argmax(nodule_probs))
+            if key is None or nodule_probs[best].item() > key[0]:
+                key = (nodule_probs[best].item(), chunk[best], std_imgs[best], std_u8s[best],
+                       attention[best].numpy(), None if members is None else members[:, best].numpy())
+
+    logits = torch.cat(slice_logits)
+    probs = torch.softmax(logits, dim=1)
+    slices = []
+    for index in range(slice_count):
+        pred_class = int(torch.argmax(probs[index]))
+        slices.append({
+            "slice": index,
+            "prediction": CLASS_NAMES[pred_class],
+            "confidence": round(probs[index, pred_class].item(), 4),
+            "nodule_probability": round(probs[index, 1].item(), 4),
+        })
+
+    nodule_probability, key_index, std_img, std_img_u8, attention_map, key_members = key
+    pred_class = int(nodule_probability >= 0.5)
+    with timer.stage("attention"):
+        attention_map = normalize_attention_map(attention_map)
     return {
-        "prediction": CLASS_NAMES[pred_class],
-        "confidence": round(confidence, 4),
-        "preview_image": heatmap_image, 
-        "original_image": preview_image,
-        "has_heatmap": True
-    }
\ No newline at end of file
+        "timings": timer.timings,
+        "model": model_name or registry.default,
+        "member_logits": key_members,
+        "std_img": std_img,
+        "std_img_u8": std_img_u8,
+        "logits": logits[key_index:key_index + 1].numpy(),
+        "pred_class": pred_class,
+        "confidence": nodule_probability if pred_class == 1 else 1.0 - nodule_probability,
+        "attention_map": attention_map,
+        "cache_key": None,  # studies are not cached
+        "slices": slices,
+        "key_slice": key_index,
+    }
+
+def predict_image(image_path, model_name=None, tta=None):
+    """Run model prediction with NODE21 preprocessing (`tta`: see run_prediction)."""
+    result = render_prediction(run_prediction(image_path, model_name, tta))
+    result.pop("timings", None)
+    return result
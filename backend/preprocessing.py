@@ -0,0 +1,62 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# ============================================================
+# CONFIGURATION (must match training)
+# ============================================================
+MODEL_INPUT_SIZE = (224, 224)
+IMAGENET_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+IMAGENET_STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+
+# ============================================================
+# SHARED PREPROCESSING
+# ============================================================
+def normalize_to_uint8(img_np, zero_if_flat=False):
+    """
+    Min-max scale an image to 0-255 uint8 in one pass.
+    Do this once per image and reuse the result for the model input,
+    the preview PNG and the heatmap overlay.
+    """
+    img_array = np.asarray(img_np).astype(np.float32)  # always a private copy
+    img_min, img_max = img_array.min(), img_array.max()
+    if img_max > img_min:
+        # In place, same arithmetic as the old per-call ((x - min) / range * 255)
+        img_array -= img_min
+        img_array /= (img_max - img_min)
+        img_array *= 255
+        return img_array.astype(np.uint8)
+    if zero_if_flat:
+        return np.zeros(img_array.shape, dtype=np.uint8)
+    return img_array.astype(np.uint8)
+
+
+def to_model_tensor(img_u8, size=MODEL_INPUT_SIZE):
+    """
+    Turn a uint8 grayscale image (H, W) or batch (N, H, W) into the
+    (N, 3, 224, 224) ImageNet-normalized tensor ResNet50 expects.
+
+    Equivalent to PIL RGB -> Resize -> ToTensor -> Normalize, but done as
+    one antialiased resize on a single channel; the grayscale channel is
+    only broadcast to three by the final normalization.
+    """
+    batch = torch.from_numpy(np.ascontiguousarray(img_u8))
+    if batch.dim() == 2:
+        batch = batch.unsqueeze(0)
+    batch = batch.unsqueeze(1).float()  # (N, 1, H, W)
+
+    if tuple(batch.shape[-2:]) != tuple(size):
+        batch = F.interpolate(batch, size=size, mode="bilinear", align_corners=False, antialias=True)
+        # PIL resizes in uint8, so quantize the same way
+        batch = batch.round_().clamp_(0, 255)
+
+    return (batch / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+
+
+def to_model_batch(images_u8, size=MODEL_INPUT_SIZE):
+    """Stack uint8 images of possibly different sizes into one model batch."""
+    shapes = {img.shape for img in images_u8}
+    if len(shapes) == 1:
+        return to_model_tensor(np.stack(images_u8), size)
+    return torch.cat([to_model_tensor(img, size) for img in images_u8], dim=0)
@@ -0,0 +1,160 @@
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(os.getcwd(), "result_cache"))
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "512"))  # 0 disables the cache
+
+# Bump when preprocessing or rendering changes so stale entries stop matching
+CACHE_FORMAT_VERSION = "2"
+
+
+# ============================================================
+# HASHING
+# ============================================================
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hex SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# ============================================================
+# DISK-BACKED LRU CACHE
+# ============================================================
+class ResultCache:
+    """
+    Content-addressed cache of standardized images and prediction outputs.
+
+    Each entry is one compressed .npz file named by
+    sha256(content hash + model checkpoint hash + format version).
+    Recency is tracked through file mtimes, so the LRU order survives
+    restarts; the least recently used entries are deleted once the
+    directory grows past `max_bytes`. Eviction re-scans the directory, so
+    several processes can share it and still stay within the budget.
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_mb=RESULT_CACHE_MAX_MB):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = self.max_bytes > 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()  # key -> size in bytes, oldest first
+        self._total = 0
+
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            self._evict()
+
+    def _scan(self):
+        """Rebuild the LRU order from what is on disk, including other processes' entries."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+
+        index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        with self._lock:
+            self._index = index
+            self._total = sum(index.values())
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def key_for_content(self, content_hash, model_hash):
+        """Entry key for an input's content hash under one model's checkpoint (and backend) hash."""
+        raw = f"{content_hash}:{model_hash}:{CACHE_FORMAT_VERSION}"
+        return hashlib.sha256(raw.encode("ascii")).hexdigest()
+
+    def get(self, key):
+        """Return the stored arrays as a dict, or None on a miss."""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                entry = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            with self._lock:
+                self._total -= self._index.pop(key, 0)
+            return None
+        except Exception as e:
+            # Corrupt or partially written entry: drop it and treat as a miss
+            print(f"⚠️ Dropping unreadable cache entry {key}: {e}")
+            self._remove(key)
+            return None
+
+        with self._lock:
+            if key in self._index:
+                self._index.move_to_end(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry
+
+    def put(self, key, **arrays):
+        """Store numpy arrays (bytes values are stored as uint8 arrays)."""
+        if not self.enabled:
+            return
+        payload = {
+            name: np.frombuffer(value, dtype=np.uint8) if isinstance(value, (bytes, bytearray)) else value
+            for name, value in arrays.items()
+        }
+
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **payload)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        size = os.path.getsize(self._path(key))
+        with self._lock:
+            self._total -= self._index.pop(key, 0)
+            self._index[key] = size
+            self._total += size
+        self._evict()
+
+    def _remove(self, key):
+        with self._lock:
+            self._total -= self._index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        self._scan()
+        while True:
+            with self._lock:
+                if self._total <= self.max_bytes or not self._index:
+                    return
+                key, size = self._index.popitem(last=False)
+                self._total -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,166 @@
+"""
+Pre-fork server for multi-core hosts (Linux/macOS).
+
+Loads the model weights once in a parent process, freezes the heap, then
+forks uvicorn workers that accept on one shared socket. The workers share
+the weight tensors copy-on-write (inference never writes to them), so
+each extra worker costs its activations and runtime state instead of
+another copy of the ResNet50. torch threads are split between workers
+so they do not oversubscribe the cores.
+
+Example:
+    python serve.py --workers 4 --port 8000
+"""
+import os
+import sys
+import gc
+import time
+import signal
+import socket
+import argparse
+
+
+# ============================================================
+# PARENT: LOAD ONCE
+# ============================================================
+def preload(predictor):
+    """
+    Load every available classifier in the parent. Only plain weight
+    loading happens here: opencxr (TensorFlow) and optimized backends
+    (ONNX Runtime sessions, TorchScript) start thread pools that do not
+    survive fork, so each worker builds those itself on startup.
+    """
+    registry = getattr(predictor, "registry", None)
+    if registry is None:
+        print("⚠️ Predictor has no model registry; workers will load their own models")
+        return
+    for name in registry.available():
+        registry.get(name).classifier()
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+# ============================================================
+# WORKER
+# ============================================================
+def run_worker(app, sock, threads, log_level, prewarm):
+    """Body of a forked worker: pin torch threads, then serve on the shared socket."""
+    import torch
+    import uvicorn
+    import main as server_main
+
+    # One worker prewarms the library; the others pick its results up from the
+    # shared result cache instead of downloading and scoring every case again
+    if not prewarm:
+        server_main.LIBRARY_PREWARM = False
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already set (or inter-op pool already used) in this process
+
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def spawn_worker(app, sock, threads, log_level, prewarm=False):
+    pid = os.fork()
+    if pid == 0:
+        # Child: default signal handling, uvicorn installs its own
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            run_worker(app, sock, threads, log_level, prewarm)
+        except BaseException as e:
+            print(f"❌ Worker {os.getpid()} crashed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+    print(f"👷 Started worker {pid} ({threads} torch thread(s){', library prewarm' if prewarm else ''})")
+    return pid
+
+
+# ============================================================
+# MAIN
+# ============================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers sharing one model copy.")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "2")))
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="torch intra-op threads per worker (default: cores // workers)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, "fork"):
+        print("serve.py needs fork(); on Windows use: uvicorn main:app --workers N")
+        return 1
+
+    workers = max(1, args.workers)
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    # Must be set before torch/executor are imported by main
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    if os.getenv("CPU_POOL_KIND", "thread").lower() == "process":
+        print("⚠️ CPU_POOL_KIND=process is not used with serve.py; workers use threads")
+    os.environ["CPU_POOL_KIND"] = "thread"
+
+    start = time.perf_counter()
+    import main as server_main
+    preload(server_main.predictor_module)
+    # Move everything loaded so far out of the GC's reach: collections in the
+    # workers would otherwise touch (and copy) every shared object header
+    gc.collect()
+    gc.freeze()
+    print(f"📦 Preloaded in {time.perf_counter() - start:.1f}s")
+
+    sock = bind_socket(args.host, args.port)
+    print(f"🚀 Listening on http://{args.host}:{args.port} with {workers} worker(s)")
+
+    # pid -> whether that worker prewarms the library (exactly one does)
+    children = {}
+    for i in range(workers):
+        children[spawn_worker(server_main.app, sock, threads, args.log_level, prewarm=i == 0)] = i == 0
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Supervise: replace workers that die unexpectedly
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        prewarm = children.pop(pid, False)
+        if not stopping:
+            print(f"⚠️ Worker {pid} exited ({status}); starting a replacement")
+            time.sleep(1)
+            children[spawn_worker(server_main.app, sock, threads, args.log_level, prewarm)] = prewarm
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+import os
+import time
+import secrets
+import threading
+from collections import OrderedDict
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "900"))
+# Each session holds a full standardized image, so also cap the count
+SESSION_MAX_ITEMS = int(os.getenv("SESSION_MAX_ITEMS", "64"))
+
+
+# ============================================================
+# IN-MEMORY TTL STORE
+# ============================================================
+class SessionStore:
+    """
+    Maps opaque handles to in-memory values for a limited time.
+    Used so /predict can reuse the image that /preview already decoded
+    and standardized instead of receiving the upload a second time.
+    """
+
+    def __init__(self, ttl_s=SESSION_TTL_S, max_items=SESSION_MAX_ITEMS):
+        self.ttl_s = ttl_s
+        self.max_items = max(1, max_items)
+        self._items = OrderedDict()  # handle -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+
+    def put(self, value):
+        """Store a value and return its new handle."""
+        handle = secrets.token_urlsafe(16)
+        with self._lock:
+            self._purge_expired()
+            self._items[handle] = (time.monotonic() + self.ttl_s, value)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return handle
+
+    def get(self, handle):
+        """Return the stored value, or None if unknown or expired."""
+        with self._lock:
+            item = self._items.get(handle)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[handle]
+                return None
+            return value
+
+    def discard(self, handle):
+        with self._lock:
+            self._items.pop(handle, None)
+
+    def __len__(self):
+        with self._lock:
+            self._purge_expired()
+            return len(self._items)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        expired = [h for h, (expires_at, _) in self._items.items() if expires_at < now]
+        for handle in expired:
+            del self._items[handle]
@@ -0,0 +1,106 @@
+import os
+
+import torch
+import torch.nn.functional as F
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+# Views scored for ?tta=true; all of them go through the model in one batch,
+# so keep their number at or below BATCH_MAX_SIZE
+TTA_VIEWS = [v.strip() for v in os.getenv(
+    "TTA_VIEWS", "identity,hflip,shift_left,shift_right,shift_up,shift_down").split(",") if v.strip()]
+TTA_SHIFT = float(os.getenv("TTA_SHIFT", "0.04"))  # shift views move the image by this fraction of its size
+TTA_ZOOM = float(os.getenv("TTA_ZOOM", "0.1"))     # zoom views scale the image by 1 +/- this
+
+# name -> (horizontal flip, x shift, y shift, scale); shifts are fractions of
+# the image size, positive moves the content right / down
+VIEWS = {
+    "identity": (False, 0.0, 0.0, 1.0),
+    "hflip": (True, 0.0, 0.0, 1.0),
+    "shift_left": (False, -TTA_SHIFT, 0.0, 1.0),
+    "shift_right": (False, TTA_SHIFT, 0.0, 1.0),
+    "shift_up": (False, 0.0, -TTA_SHIFT, 1.0),
+    "shift_down": (False, 0.0, TTA_SHIFT, 1.0),
+    "zoom_in": (False, 0.0, 0.0, 1.0 + TTA_ZOOM),
+    "zoom_out": (False, 0.0, 0.0, 1.0 - TTA_ZOOM),
+}
+
+
+def parse_views(spec):
+    """
+    ?tta= value -> list of view names: "true"/"1" means TTA_VIEWS, anything
+    else is a comma-separated list. None, "" and "false" mean no TTA.
+    Raises ValueError for unknown views.
+    """
+    if spec is None or spec.strip().lower() in ("", "false", "0", "none"):
+        return None
+    if spec.strip().lower() in ("true", "1"):
+        views = TTA_VIEWS
+    else:
+        views = [v.strip() for v in spec.split(",") if v.strip()]
+    unknown = [v for v in views if v not in VIEWS]
+    if unknown or not views:
+        raise ValueError(f"Unknown TTA view(s) {', '.join(unknown) or '(none given)'}. "
+                         f"Choose from {', '.join(VIEWS)}.")
+    return list(dict.fromkeys(views))
+
+
+# ============================================================
+# AUGMENTATION
+# ============================================================
+def _theta(view, inverse=False):
+    """2x3 affine_grid matrix mapping output coordinates to input coordinates."""
+    flip, dx, dy, scale = VIEWS[view]
+    sx = -1.0 if flip else 1.0
+    if inverse:
+        # Undo the shift and zoom, then the flip (which is its own inverse)
+        return torch.tensor([[sx * scale, 0.0, 2 * dx], [0.0, scale, 2 * dy]])
+    # Flip, then zoom, then shift (normalized coordinates span 2 per image side)
+    return torch.tensor([[sx / scale, 0.0, -sx * 2 * dx / scale], [0.0, 1.0 / scale, -2 * dy / scale]])
+
+
+def _warp(batch, views, inverse=False):
+    """Apply (or undo) one view per row of an (N, C, H, W) batch; flips and identity are exact."""
+    if all(VIEWS[v][1:] == (0.0, 0.0, 1.0) for v in views):
+        flips = torch.tensor([VIEWS[v][0] for v in views])
+        return torch.where(flips[:, None, None, None], torch.flip(batch, dims=[3]), batch)
+    theta = torch.stack([_theta(v, inverse) for v in views]).to(batch.dtype)
+    grid = F.affine_grid(theta, list(batch.shape), align_corners=False)
+    # Pixels shifted in from outside repeat the edge instead of turning black
+    return F.grid_sample(batch, grid, mode="bilinear", padding_mode="border", align_corners=False)
+
+
+def augment(img_tensor, views):
+    """(1, 3, H, W) model input -> (len(views), 3, H, W) batch, one row per view."""
+    return _warp(img_tensor.expand(len(views), -1, -1, -1), views)
+
+
+def align_attention(attention, views):
+    """Map each view's (h, w) attention map back onto the original image: (V, h, w) -> (V, h, w)."""
+    return _warp(attention[:, None], views, inverse=True)[:, 0]
+
+
+# ============================================================
+# FUSION
+# ============================================================
+def fuse(logits, attention, views):
+    """
+    Combine the per-view outputs of one image. Returns the mean-probability
+    log-logits (1, C), the fused attention map (h, w) in [0, 1] and the
+    per-view probabilities (V, C).
+    """
+    probs = torch.softmax(logits, dim=1)
+    fused_attention = align_attention(attention, views).mean(dim=0)
+    return torch.log(probs.mean(dim=0, keepdim=True)), fused_attention, probs
+
+
+def summarize(view_probs, views):
+    """The ?tta= response fields from (V, C) numpy probabilities: per-view nodule probability and their spread."""
+    nodule = view_probs[:, 1]
+    return {
+        "views": {view: round(float(p), 4) for view, p in zip(views, nodule)},
+        "nodule_probability": round(float(nodule.mean()), 4),
+        "std": round(float(nodule.std()), 4),
+        "range": round(float(nodule.max() - nodule.min()), 4),
+    }
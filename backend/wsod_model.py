@@ -18,20 +18,34 @@ class WSODModel(nn.Module):
     def forward(self, x):
         return self.base_model(x)
     
+    def forward_with_attention(self, x):
+        """Classification logits and layer4 attention map from a single forward pass"""
+        if hasattr(self.base_model, 'forward_features') and hasattr(self.base_model, 'forward_head'):
+            # timm models: forward_features stops right after layer4
+            features = self.base_model.forward_features(x)
+            logits = self.base_model.forward_head(features)
+        else:
+            # Generic fallback: capture layer4's output with a forward hook
+            captured = {}
+            handle = self.base_model.layer4.register_forward_hook(
+                lambda module, inputs, output: captured.update(features=output)
+            )
+            try:
+                logits = self.base_model(x)
+            finally:
+                handle.remove()
+            features = captured['features']
+        
+        # Attention: average across channels, keep positive evidence only
+        attention = F.relu(features.mean(dim=1, keepdim=True))
+        return logits, attention
+    
     def get_attention_map(self, x):
         """Get attention map from last conv layer"""
-        # Forward pass to get activations
-        features = x
-        for name, module in self.base_model.named_children():
-            features = module(features)
-            if name == 'layer4':
-                # Get attention from layer4 output
-                attention = features.mean(dim=1, keepdim=True)  # Average across channels
-                break
+        _, attention = self.forward_with_attention(x)
         
         # Normalize attention
-        attention = F.relu(attention)
         attention = attention - attention.min()
         attention = attention / (attention.max() + 1e-8)
         
-        return attention
\ No newline at end of file
+        return attention
@@ -34,6 +34,8 @@ export function UploadSection({
   const fileInputRef = useRef(null);
   const [error, setError] = useState(null);
   const [isLibraryOpen, setIsLibraryOpen] = useState(false);
+  // Handle from /preview so /predict can reuse the already-uploaded image
+  const [previewHandle, setPreviewHandle] = useState(null);
 
   // Prediction Logic
   const predictedClass = prediction?.prediction || prediction?.class || "--";
@@ -63,6 +65,7 @@ export function UploadSection({
     setSelectedFile(file);
     setPrediction(null);
     setError(null);
+    setPreviewHandle(null);
 
     if (file.name.toLowerCase().endsWith(".mha")) {
       setLoading(true);
@@ -76,6 +79,7 @@ export function UploadSection({
         const result = await response.json();
         if (result.preview_image) setPreviewUrl(result.preview_image);
         else setError("Could not generate preview.");
+        if (result.handle) setPreviewHandle(result.handle);
       } catch (err) {
         setError("Server preview failed.");
       } finally {
@@ -98,6 +102,7 @@ export function UploadSection({
     setPrediction(null);
     setError(null);
     setPreviewUrl(null);
+    setPreviewHandle(null);
 
     const cloudFileObj = {
       name: caseItem.title,
@@ -122,6 +127,15 @@ export function UploadSection({
     }
   };
 
+  const uploadForPrediction = (file) => {
+    const formData = new FormData();
+    formData.append("file", file);
+    return fetch(`${API_BASE}/predict`, {
+      method: "POST",
+      body: formData,
+    });
+  };
+
   // Classify
   const handleClassify = async () => {
     if (!selectedFile) return;
@@ -138,16 +152,24 @@ export function UploadSection({
           headers: { "Content-Type": "application/json" },
           body: JSON.stringify({ file_id: selectedFile.googleDriveId }),
         });
-      } else {
+      } else if (previewHandle) {
+        // Reuse the image the server kept from /preview (no second upload)
         const formData = new FormData();
-        formData.append("file", selectedFile);
+        formData.append("handle", previewHandle);
         response = await fetch(`${API_BASE}/predict`, {
           method: "POST",
           body: formData,
         });
+      } else {
+        response = await uploadForPrediction(selectedFile);
       }
 
-      const result = await response.json();
+      let result = await response.json();
+      if (result.session_expired) {
+        // Server forgot the preview; fall back to uploading the file again
+        setPreviewHandle(null);
+        result = await (await uploadForPrediction(selectedFile)).json();
+      }
       if (result.error) throw new Error(result.error);
 
       setPrediction(result);